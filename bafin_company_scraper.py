@@ -1,138 +1,259 @@
 import os
 import logging
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Setup logging
-logging.basicConfig(filename='bafin_company_scraper.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# Get environment variables
-BASE_URL_COMPANY = os.getenv('BAFIN_DB_COMPANY')  # Base URL for the Bafin database
-CATEGORY_ID_COMPANY = os.getenv('BAFIN_DB_COMPANY_CATEGORY_ID')  # Category ID to scrape
-SEARCH_BUTTON_LABEL = os.getenv('BAFIN_SEARCH_BUTTON_LABEL', 'Suche')  # Default search button label
-
-def create_driver():
-    options = Options()
-    options.headless = True
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-
-    driver = webdriver.Remote(
-        command_executor='http://localhost:4444/wd/hub',
-        options=options,
-        keep_alive=True
-    )
-    driver.set_page_load_timeout(120)
-    driver.implicitly_wait(30)
-    return driver
+from manifest import record_file, replacing
+from driver_pool import get_driver_pool, load_page, fetch_page_source
+from detail_fetcher import fetch_details
+from http_scraper import JavaScriptRequired, fetch_soup, fetch_pages, page_soup
+from utils import (
+    get_scrape_mode,
+    get_bafin_search_button_label,
+    get_bafin_db_company_url,
+    get_bafin_db_company_category_id
+)
+from crawl_state import get_crawl_state
+from snapshot_store import use_columnar_storage, save_records
+from resilience import CircuitOpenError
+from cancellation import Cancelled
+from metrics import get_metrics
+from parsing import find_path_text
+from urls import resolve_url
+from categories import ALL, IncompleteListing, parse_selection, parse_options, crawl_categories
+
+# Source name used for crawl state and run metrics
+SOURCE = 'bafin_company'
+
+# Where a detail page names its institution: #wrapperContent #content p strong, first match each
+TITLE_PATH = (('div', 'wrapperContent'), ('div', 'content'), ('p', None), ('strong', None))
+
+def build_category_url(base_url, category_id):
+    return f"{base_url}/sucheForm.do?institutName=&institutId=&institutBakNr=&institutRegNr=&kategorieId={category_id}&sucheButtonInstitut={get_bafin_search_button_label()}&locale=en_GB"
 
 def scrape_bafin_company(base_url, category_id):
-    all_data = []
-    driver = create_driver()
+    """
+    Yield a record for every institution listed in the category as soon as
+    its detail page has been fetched, so records can be saved while the
+    remaining pages are still being fetched.
+    """
+    if get_scrape_mode('BAFIN_COMPANY') == 'http':
+        try:
+            yield from scrape_bafin_company_http(base_url, category_id)
+            return
+        except JavaScriptRequired as e:
+            logging.warning(f"Falling back to Selenium for Bafin Company: {e}")
+
+    category_name, links_to_scrape = discover_links(base_url, category_id)
+
+    # Now scrape data from the collected links, spread over several grid sessions
+    links_to_fetch = get_crawl_state().plan(SOURCE, category_name, links_to_scrape)
+    scraped = 0
+    for link, result, error in fetch_details(links_to_fetch, scrape_page_content, source=SOURCE):
+        if error:
+            logging.error(f"Error scraping page content from {link}: {error}")
+            continue
+        title, content = result
+        if title and content:
+            scraped += 1
+            logging.info(f"Scraped content from {link} with title: {title}")
+            yield {'category': category_name, 'link': link, 'title': title, 'content': content}
+
+    logging.info(f"Successfully scraped {scraped} links from Bafin Company site.")
+
+def run(context, url=None, category=None):
+    # Categories are crawled side by side, each saving its records as their detail pages arrive
+    bafin_company_url = url or get_bafin_db_company_url()
+    print(f"Scraping Bafin Company URL: {bafin_company_url}")
+    categories = select_categories(bafin_company_url, category or get_bafin_db_company_category_id())
+    crawl_categories(SOURCE, categories, lambda category_id, _: save_data(scrape_bafin_company(bafin_company_url, category_id), context.base_path))
+    print(f"Finished scraping Bafin Company URL: {bafin_company_url}")
+
+def select_categories(base_url, setting):
+    """
+    Return `(id, name)` for the categories chosen by `setting`. With 'all'
+    they are read from the #institutKategorie select; listed IDs are used as
+    given and named once their listing is loaded.
+    """
+    selection = parse_selection(setting)
+    if selection == ALL:
+        return discover_categories(base_url)
+    return [(category_id, None) for category_id in selection or []]
+
+def discover_categories(base_url):
+    # Every search page carries the category select, an empty search included
+    url = build_category_url(base_url, '')
+    if get_scrape_mode('BAFIN_COMPANY') == 'http':
+        try:
+            soup, _ = fetch_soup(url, required='#institutKategorie')
+            return parse_options(soup, '#institutKategorie')
+        except JavaScriptRequired as e:
+            logging.warning(f"Falling back to Selenium for the Bafin Company categories: {e}")
+
+    with get_driver_pool(SOURCE).lease() as driver:
+        load_page(driver, url)
+        WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, 'institutKategorie')))
+        soup, _ = page_soup(driver)
+    return parse_options(soup, '#institutKategorie')
+
+def discover_links(base_url, category_id):
+    """
+    Walk the category's listing pages in the browser and return the category
+    name and the set of detail page links.
+    """
+    links_to_scrape = set()  # Use a set to avoid duplicates
+    category_name = ""
+    metrics = get_metrics()
+
+    with get_driver_pool(SOURCE).lease() as driver:
+        try:
+            # Construct the category URL
+            category_url = build_category_url(base_url, category_id)
+            logging.info(f"Processing category URL: {category_url}")
+
+            load_page(driver, category_url)
+            WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.ID, 'institutKategorie')))
+
+            # Extract category name from the <select> element
+            soup, _ = page_soup(driver)
+            category_name = parse_category_name(soup, category_id)
+            logging.info(f"Extracted category name: {category_name}")
+
+            page_number = 1
+
+            while True:
+                # Construct the pagination URL
+                paginated_url = f"{category_url}&d-4012550-p={page_number}"
+                logging.info(f"Fetching URL: {paginated_url}")
+                with metrics.span('pagination', SOURCE):
+                    load_page(driver, paginated_url)
+                    WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'tbody')))
+                    soup, page_url = page_soup(driver)
+
+                # Extract the links and the next-page marker from one snapshot of the page
+                with metrics.span('link_extraction', SOURCE):
+                    rows, links, has_next = parse_listing_page(soup, page_url)
+                if not rows:
+                    if page_number > 1:
+                        raise IncompleteListing(f"No rows on page {page_number} of {category_url}")
+                    logging.info("No rows found. Ending pagination.")
+                    break  # An empty category
+                links_to_scrape.update(links)  # Use a set for uniqueness
+
+                if not has_next:
+                    logging.info("No next page found. Ending pagination.")
+                    break  # Exit if there is no next page
+                page_number += 1  # Increment page number for the next iteration
+
+        except Exception as e:
+            logging.error(f"Error during scraping: {e}")
+            raise  # A cut-short listing would report the rest of the category as removed
+
+    return category_name, links_to_scrape
+
+def parse_category_name(soup, category_id):
+    option = soup.select_one(f'#institutKategorie option[value="{category_id}"]')
+    return option.get_text().strip() if option else ""
+
+def parse_listing_page(soup, page_url):
+    """
+    Return the number of rows on a listing page, the detail links in them
+    and whether there is a next page.
+    """
+    rows = soup.select('tbody tr')
+    links = []
+    for row in rows:
+        link_element = row.find('a')
+        if link_element is None or not link_element.get('href'):
+            logging.warning("Found a row without a linked anchor tag.")
+            continue
+        # Resolve the href the way the browser does for get_attribute('href')
+        full_link = resolve_url(link_element['href'], page_url)
+        links.append(full_link)
+        logging.info(f"Extracted link: {full_link}")
+
+    # Check for 'Next' or 'vor' among the pagination links
+    pagination_links = soup.select("span.pagelinks a")
+    has_next = any("Next" in link.get_text() or "vor" in link.get_text() for link in pagination_links)
+    return len(rows), links, has_next
+
+def scrape_bafin_company_http(base_url, category_id):
+    """
+    Same as scrape_bafin_company, but fetches the server-rendered listing and
+    detail pages over plain HTTP instead of through the Selenium grid.
+    """
     links_to_scrape = set()  # Use a set to avoid duplicates
     category_name = ""
 
     try:
-        # Construct the category URL
-        category_url = f"{base_url}/sucheForm.do?institutName=&institutId=&institutBakNr=&institutRegNr=&kategorieId={category_id}&sucheButtonInstitut={SEARCH_BUTTON_LABEL}&locale=en_GB"
-        logging.info(f"Processing category URL: {category_url}")
-
-        driver.get(category_url)
-
-        # Extract category name from the <select> element
-        category_select = driver.find_element(By.ID, 'institutKategorie')
-        options = category_select.find_elements(By.TAG_NAME, 'option')
-        for option in options:
-            if option.get_attribute('value') == category_id:
-                category_name = option.text.strip()
-                break
+        category_url = build_category_url(base_url, category_id)
+        logging.info(f"Processing category URL over HTTP: {category_url}")
+        soup, _ = fetch_soup(category_url, required='#institutKategorie')
 
+        category_name = parse_category_name(soup, category_id)
         logging.info(f"Extracted category name: {category_name}")
 
         page_number = 1
 
         while True:
-            # Construct the pagination URL
             paginated_url = f"{category_url}&d-4012550-p={page_number}"
             logging.info(f"Fetching URL: {paginated_url}")
-            driver.get(paginated_url)
-
-            # Extract links for each institution
-            WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'tbody')))
-            rows = driver.find_elements(By.CSS_SELECTOR, 'tbody tr')
+            with get_metrics().span('pagination', SOURCE):
+                try:
+                    # A page the previous one linked to must hold the listing table
+                    soup, page_url = fetch_soup(paginated_url, required='tbody' if page_number > 1 else None)
+                except JavaScriptRequired as e:
+                    raise IncompleteListing(f"No listing on page {page_number} of {category_url}") from e
 
+            rows, links, has_next = parse_listing_page(soup, page_url)
             if not rows:
-                logging.info("No more rows found. Ending pagination.")
-                break  # Exit loop if no rows are found
-
-            # Extract links from the current page
-            for row in rows:
-                try:
-                    link_element = row.find_element(By.TAG_NAME, 'a')
-                    link = link_element.get_attribute('href').replace("amp;", "")
-                    if link:
-                        full_link = f"{base_url}/{link}" if not link.startswith('http') else link
-                        links_to_scrape.add(full_link)  # Add link to the set for uniqueness
-                        logging.info(f"Extracted link: {full_link}")
-                    else:
-                        logging.warning("Found an anchor tag without an href attribute.")
-                except Exception as e:
-                    logging.error(f"Error extracting link from row: {e}")
-
-            # Check for the next page
-            try:
-                pagination_links = driver.find_elements(By.CSS_SELECTOR, "span.pagelinks a")
-                next_page_found = False
-
-                for link in pagination_links:
-                    if "Next" in link.text or "vor" in link.text:  # Check for 'Next' or 'vor'
-                        next_page_found = True
-                        page_number += 1  # Increment page number for the next iteration
-                        break
-
-                if not next_page_found:
-                    logging.info("No next page found. Ending pagination.")
-                    break  # Exit if there is no next page
-            except Exception:
-                logging.info("No pagination links found. Ending pagination.")
-                break  # Exit if no pagination links are found
-
-        # Now scrape data from the collected links
-        for link in links_to_scrape:
-            try:
-                title, content = scrape_page_content(driver, link)
-                if title and content:
-                    all_data.append({'category': category_name, 'link': link, 'title': title, 'content': content})
-                    logging.info(f"Scraped content from {link} with title: {title}")
-            except Exception as e:
-                logging.error(f"Error scraping page content from {link}: {e}")
+                if page_number > 1:
+                    raise IncompleteListing(f"No rows on page {page_number} of {category_url}")
+                logging.info("No rows found. Ending pagination.")
+                break
+            links_to_scrape.update(links)
 
+            if not has_next:
+                logging.info("No next page found. Ending pagination.")
+                break
+            page_number += 1
+    except JavaScriptRequired:
+        raise
     except Exception as e:
         logging.error(f"Error during scraping: {e}")
-    finally:
-        driver.quit()
+        raise  # A cut-short listing would report the rest of the category as removed
 
-    logging.info(f"Successfully scraped {len(all_data)} links from Bafin Company site.")
-    return all_data
+    links_to_fetch = get_crawl_state().plan(SOURCE, category_name, links_to_scrape)
+    scraped = 0
+    for link, content in fetch_pages(links_to_fetch, SOURCE):
+        if not content:
+            continue
+        try:
+            with get_metrics().span('parse', SOURCE):
+                title = extract_title(content)
+        except Exception as e:
+            logging.error(f"Error extracting title from {link}: {e}")
+            continue
+        if title:
+            scraped += 1
+            logging.info(f"Scraped content from {link} with title: {title}")
+            yield {'category': category_name, 'link': link, 'title': title, 'content': content}
+
+    logging.info(f"Successfully scraped {scraped} links from Bafin Company site over HTTP.")
 
 def scrape_page_content(driver, url):
     page_content = ""
     title = ""
 
+    metrics = get_metrics()
     try:
-        driver.get(url)
-        WebDriverWait(driver, 20).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
-        page_content = driver.page_source
-        title = extract_title(page_content)
+        with metrics.span('detail_fetch', SOURCE):
+            page_content = fetch_page_source(driver, url, (By.TAG_NAME, 'body'), 20)
+        with metrics.span('parse', SOURCE):
+            title = extract_title(page_content)
+    except (CircuitOpenError, Cancelled):
+        raise
     except Exception as e:
         logging.error(f"Error loading page content from {url}: {e}")
         return None, None  # Return None if there's an error
@@ -140,31 +261,25 @@ def scrape_page_content(driver, url):
     return title, page_content
 
 def extract_title(page_content):
-    soup = BeautifulSoup(page_content, 'html.parser')
-
-    # Find the <div> with id 'content' within 'wrapperContent'
-    content_div = soup.find('div', id='wrapperContent').find('div', id='content')
-
-    if content_div:
-        # Find the first <p> tag within the content div
-        first_paragraph = content_div.find('p')
-        if first_paragraph:
-            strong_element = first_paragraph.find('strong')  # Look for the <strong> tag
-            if strong_element:
-                title = strong_element.text.strip()
-                # Replace problematic characters
-                title = title.replace('/', '-').replace('\\', '-').replace(':', '-').replace(' ', '_').replace('.', '')
-                return title
-            else:
-                logging.warning("No <strong> tag found in the first <p>.")
-        else:
-            logging.warning("No <p> tag found in the content div.")
-    else:
-        logging.warning("No content div found within the wrapper content.")
-
-    return None  # Return None if title is not found
+    # Parsing stops at the first <strong> of the content's first <p>, the rest of the page is skipped
+    title = find_path_text(page_content, TITLE_PATH)
+    if title is None:
+        logging.warning("No <strong> title found in the first <p> of the content div.")
+        return None  # Return None if title is not found
+
+    # Replace problematic characters
+    title = title.strip()
+    return title.replace('/', '-').replace('\\', '-').replace(':', '-').replace(' ', '_').replace('.', '')
 
 def save_data(data, base_path):
+    """
+    Save records as they arrive from `data`, which may be a generator.
+    """
+    if use_columnar_storage():
+        save_records(base_path, os.path.join('bafin', 'BAFIN_DB_COMPANY'), data, SOURCE)
+        return
+
+    metrics = get_metrics()
     for entry in data:
         category_dir = os.path.join(base_path, 'bafin', 'BAFIN_DB_COMPANY', entry['category'])
         if not os.path.exists(category_dir):
@@ -175,8 +290,11 @@ def save_data(data, base_path):
         file_path = os.path.join(category_dir, f"{title}.csv")
 
         try:
-            df = pd.DataFrame([{'category': entry['category'], 'link': entry['link'], 'title': title}])
-            df.to_csv(file_path, index=False)
+            with metrics.span('save', SOURCE):
+                df = pd.DataFrame([{'category': entry['category'], 'link': entry['link'], 'title': title}])
+                with replacing(file_path) as tmp_path:
+                    df.to_csv(tmp_path, index=False)
+                get_crawl_state().record_fetch(SOURCE, entry['category'], entry['link'], entry.get('content'), entry['title'], record_file(file_path))
             logging.info(f"Saved data to {file_path}")
         except PermissionError as e:
             logging.error(f"Permission error when saving {file_path}: {e}")
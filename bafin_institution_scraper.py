@@ -1,5 +1,3 @@
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
@@ -7,82 +5,186 @@ import pandas as pd
 import os
 import logging
 import re
-from dotenv import load_dotenv
+from urllib.parse import urljoin, urlsplit, parse_qsl
+from manifest import record_file, replacing
+from driver_pool import get_driver_pool, load_page, fetch_page_source
+from detail_fetcher import fetch_details
+from http_scraper import JavaScriptRequired, fetch_soup, fetch_pages, form_fields, page_soup
+from fetch_engine import create_session
+from utils import get_scrape_mode, get_bafin_institution_url, get_bafin_institution_category_id, get_uploads_dir
+from crawl_state import get_crawl_state
+from snapshot_store import use_columnar_storage, save_records
+from blob_store import content_fields
+from resilience import CircuitOpenError
+from cancellation import Cancelled
+from metrics import get_metrics
+from urls import resolve_url, rebase_url
+from categories import ALL, IncompleteListing, parse_selection, parse_options, crawl_categories
+
+SEARCH_URL = "https://portal.mvp.bafin.de/database/ZahlInstInfo/suche.do"
+
+# Source name used for crawl state and run metrics
+SOURCE = 'bafin_institution'
 
-# Load environment variables
-load_dotenv()
+def sanitize_filename(name):
+    return re.sub(r'[<>:"/\\|?*]', '_', name)  # Replace invalid characters with underscores
 
-# Setup logging
-logging.basicConfig(filename='bafin_institution_scraper.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def scrape_bafin_institution(base_url, category_id, base_path=None):
+    base_path = base_path or os.path.join(get_uploads_dir(), 'current_state')
+    if get_scrape_mode('BAFIN_INSTITUTION') == 'http':
+        try:
+            return scrape_bafin_institution_http(base_url, category_id, base_path)
+        except JavaScriptRequired as e:
+            logging.warning(f"Falling back to Selenium for Bafin Institution: {e}")
 
-# Get environment variables
-BASE_URL = os.getenv('BAFIN_INSTITUTION')
-CATEGORY_ID = os.getenv('BAFIN_INSTITUTION_CATEGORY_ID')
+    all_scrapable_links = []
+    category_name = ""
 
-def create_driver():
-    options = Options()
-    options.headless = True
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
+    with get_driver_pool(SOURCE).lease() as driver:
+        try:
+            # Navigate to the base URL
+            load_page(driver, base_url)
+            logging.info(f"Navigated to base URL: {base_url}")
 
-    driver = webdriver.Remote(
-        command_executor='http://localhost:4444/wd/hub',
-        options=options
-    )
-    return driver
+            # Select the category from the dropdown and submit
+            category_name = select_category(driver, category_id)
 
-def sanitize_filename(name):
-    return re.sub(r'[<>:"/\\|?*]', '_', name)  # Replace invalid characters with underscores
+            # Scrape data from the category page
+            with get_metrics().span('pagination', SOURCE):
+                all_scrapable_links.extend(scrape_category_pages(driver, category_id))
+        except Exception as e:
+            logging.error(f"Error during scraping: {e}")
+            raise  # A cut-short listing would report the rest of the category as removed
 
-def scrape_bafin_institution(base_url, category_id):
-    driver = create_driver()
-    all_scrapable_links = []
-    category_name = ""
+    # Scrape content from each scrapable link, spread over several grid sessions, and save it
+    links_to_fetch = get_crawl_state().plan(SOURCE, category_name, all_scrapable_links)
+    pages = fetch_details(links_to_fetch, scrape_page_content, source=SOURCE)
+    save_pages(((link, content) for link, content, error in pages), category_name, base_path)
 
-    try:
-        # Navigate to the base URL
-        driver.get(base_url)
-        logging.info(f"Navigated to base URL: {base_url}")
+    logging.info(f"Successfully scraped {len(all_scrapable_links)} links from Bafin Institution site.")
 
-        # Select the category from the dropdown and submit
-        category_name = select_category(driver, category_id)
+    return all_scrapable_links, category_name  # Return both data and category_name
 
-        # Scrape data from the category page
-        all_scrapable_links.extend(scrape_category_pages(driver, category_id))
+def run(context, url=None, category=None):
+    bafin_institution_url = url or get_bafin_institution_url()
+    print(f"Scraping Bafin Institution URL: {bafin_institution_url}")
+    categories = select_categories(category or get_bafin_institution_category_id())
+    crawl_categories(SOURCE, categories, lambda category_id, _: scrape_category(bafin_institution_url, category_id, context.base_path))
+
+def scrape_category(base_url, category_id, base_path):
+    bafin_institution_data, category_name = scrape_bafin_institution(base_url, category_id, base_path)
+    if bafin_institution_data:
+        print(f"Data is being scraped from Bafin Institution category: {category_name}")
+    else:
+        print(f"No data scraped from Bafin Institution category: {category_name or category_id}")
+
+def select_categories(setting):
+    """
+    Return `(id, name)` for the categories chosen by `setting`. With 'all'
+    they are read from the #filterObjektart select; listed IDs are used as
+    given and named once they are selected.
+    """
+    selection = parse_selection(setting)
+    if selection == ALL:
+        return discover_categories()
+    return [(category_id, None) for category_id in selection or []]
+
+def discover_categories():
+    if get_scrape_mode('BAFIN_INSTITUTION') == 'http':
+        try:
+            soup, _ = fetch_soup(SEARCH_URL, required='#filterObjektart')
+            return parse_options(soup, '#filterObjektart')
+        except JavaScriptRequired as e:
+            logging.warning(f"Falling back to Selenium for the Bafin Institution categories: {e}")
+
+    with get_driver_pool(SOURCE).lease() as driver:
+        load_page(driver, SEARCH_URL)
+        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'filterObjektart')))
+        soup, _ = page_soup(driver)
+    return parse_options(soup, '#filterObjektart')
+
+def scrape_bafin_institution_http(base_url, category_id, base_path=None):
+    """
+    Same as scrape_bafin_institution, but submits the search form and fetches
+    the result and detail pages over plain HTTP instead of the Selenium grid.
+    """
+    base_path = base_path or os.path.join(get_uploads_dir(), 'current_state')
+    all_scrapable_links = []
+    category_name = ""
 
-        # Scrape content from each scrapable link and save to CSV
-        for link in all_scrapable_links:
-            content = scrape_page_content(driver, link)
-            if content:
-                title = extract_title_from_link(link)
-                save_data(content, title, category_name)
+    # The search lives in the server-side session, so categories crawled
+    # side by side each walk their results on a session of their own
+    session = create_session(1)
 
-        logging.info(f"Successfully scraped {len(all_scrapable_links)} links from Bafin Institution site.")
+    try:
+        soup, search_url = fetch_soup(SEARCH_URL, required='#filterObjektart', session=session)
+        logging.info("Fetched the category search page over HTTP.")
+
+        category_select = soup.select_one('#filterObjektart')
+        category_name = parse_category_name(soup, category_id)
+        logging.info(f"Selected category: {category_name} (ID: {category_id})")
+
+        # Submit the search form the way the browser does after selecting the category
+        form = category_select.find_parent('form')
+        data = form_fields(form, {category_select.get('name', 'filterObjektart'): str(category_id)}, submit_id='nameZahlungsinstitutButton')
+        action = urljoin(search_url, form.get('action') or search_url)
+        with get_metrics().span('pagination', SOURCE):
+            soup, page_url = fetch_soup(action, method=(form.get('method') or 'GET').upper(), data=data, session=session)
+
+        page_number = 1
+
+        while True:
+            logging.info(f"Processing category page: {page_url}")
+            rows, links, next_page_url = parse_result_page(soup, page_url, page_number)
+            if not rows:
+                if page_number > 1:
+                    raise IncompleteListing(f"No rows on result page {page_number}: {page_url}")
+                logging.info("No rows found, ending scraping.")
+                break
+            all_scrapable_links.extend(links)
+            logging.info(f"Found {rows} links on page {page_number}.")
+
+            if not next_page_url:
+                logging.info("No more pages to process.")
+                break
+            page_number += 1
+            with get_metrics().span('pagination', SOURCE):
+                try:
+                    # A page the previous one linked to must hold the result table
+                    soup, page_url = fetch_soup(next_page_url, required='tbody', session=session)
+                except JavaScriptRequired as e:
+                    raise IncompleteListing(f"No results on page {page_number}: {next_page_url}") from e
+            logging.info(f"Navigating to page {page_number}...")
+    except JavaScriptRequired:
+        raise
     except Exception as e:
         logging.error(f"Error during scraping: {e}")
+        raise  # A cut-short listing would report the rest of the category as removed
     finally:
-        driver.quit()
+        session.close()
 
-    return all_scrapable_links, category_name  # Return both data and category_name
+    links_to_fetch = get_crawl_state().plan(SOURCE, category_name, all_scrapable_links)
+    save_pages(fetch_pages(links_to_fetch, SOURCE), category_name, base_path)
+
+    logging.info(f"Successfully scraped {len(all_scrapable_links)} links from Bafin Institution site over HTTP.")
+
+    return all_scrapable_links, category_name
 
 def select_category(driver, category_id):
-    driver.get("https://portal.mvp.bafin.de/database/ZahlInstInfo/suche.do")
+    load_page(driver, SEARCH_URL)
     logging.info("Navigated to the category search page.")
 
-    # Wait for the dropdown to be present and select the category
+    # Wait for the dropdown to be present and read the category name from a snapshot of the page
     WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'filterObjektart')))
-    category_select = driver.find_element(By.ID, 'filterObjektart')
-    category_select.click()  # Open the dropdown
-    logging.info("Opened category dropdown.")
+    soup, _ = page_soup(driver)
+    category_name = parse_category_name(soup, category_id)
 
-    options = category_select.find_elements(By.TAG_NAME, 'option')
-    category_name = ""
-    for option in options:
-        if option.get_attribute('value') == str(category_id):
-            category_name = option.text.strip()  # Get the category name
-            option.click()  # Select the category
-            logging.info(f"Selected category: {category_name} (ID: {category_id})")
-            break
+    # Select the category and submit, touching only the elements involved
+    driver.find_element(By.ID, 'filterObjektart').click()  # Open the dropdown
+    option = driver.find_elements(By.CSS_SELECTOR, f'#filterObjektart option[value="{category_id}"]')
+    if option:
+        option[0].click()  # Select the category
+        logging.info(f"Selected category: {category_name} (ID: {category_id})")
 
     submit_button = driver.find_element(By.ID, 'nameZahlungsinstitutButton')
     submit_button.click()
@@ -95,29 +197,22 @@ def scrape_category_pages(driver, category_id):
     page_number = 1
 
     while True:
-        logging.info(f"Processing category page: {driver.current_url}")
         WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, 'tbody')))
+        soup, page_url = page_soup(driver)
+        logging.info(f"Processing category page: {page_url}")
 
-        rows = driver.find_elements(By.CSS_SELECTOR, 'tbody tr')
+        rows, links, next_page_url = parse_result_page(soup, page_url, page_number)
         if not rows:
+            if page_number > 1:
+                raise IncompleteListing(f"No rows on result page {page_number}: {page_url}")
             logging.info("No rows found, ending scraping.")
             break
+        scrapable_links.extend(links)
+        logging.info(f"Found {rows} links on page {page_number}.")
 
-        for row in rows:
-            link_element = row.find_element(By.TAG_NAME, 'a')
-            extracted_link = link_element.get_attribute('href').replace("amp;", "")
-            scrapable_link = f"{BASE_URL}/{extracted_link.split('/')[-1]}"
-            scrapable_links.append(scrapable_link)
-            logging.info(f"Extracted scrapable link: {scrapable_link}")
-
-        logging.info(f"Found {len(rows)} links on page {page_number}.")
-
-        next_button = driver.find_elements(By.CSS_SELECTOR, 'a[title="zum Abschnitt {}"]'.format(page_number + 1))
-
-        if next_button:
+        if next_page_url:
             page_number += 1
-            next_page_url = next_button[0].get_attribute('href')
-            driver.get(next_page_url)
+            load_page(driver, next_page_url)
             logging.info(f"Navigating to page {page_number}...")
         else:
             logging.info("No more pages to process.")
@@ -125,28 +220,77 @@ def scrape_category_pages(driver, category_id):
 
     return scrapable_links
 
+def parse_category_name(soup, category_id):
+    option = soup.select_one(f'#filterObjektart option[value="{category_id}"]')
+    return option.get_text().strip() if option else ""
+
+def parse_result_page(soup, page_url, page_number):
+    """
+    Return the number of rows on a result page, the detail links in them
+    and the URL of the next page, or None on the last page.
+    """
+    rows = soup.select('tbody tr')
+    links = []
+    for row in rows:
+        link_element = row.find('a')
+        if link_element is None or not link_element.get('href'):
+            continue
+        # Detail pages are fetched from the configured register URL, whichever path the result page links
+        scrapable_link = rebase_url(resolve_url(link_element['href'], page_url), get_bafin_institution_url())
+        links.append(scrapable_link)
+        logging.info(f"Extracted scrapable link: {scrapable_link}")
+
+    next_button = soup.select_one('a[title="zum Abschnitt {}"]'.format(page_number + 1))
+    next_page_url = resolve_url(next_button['href'], page_url) if next_button is not None and next_button.get('href') else None
+    return len(rows), links, next_page_url
+
 def scrape_page_content(driver, url):
     content = ""
 
     try:
-        driver.get(url)
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
-        content = driver.page_source
+        with get_metrics().span('detail_fetch', SOURCE):
+            content = fetch_page_source(driver, url, (By.TAG_NAME, 'body'))
         logging.info(f"Scraped content from {url}.")
+    except (CircuitOpenError, Cancelled):
+        raise
     except Exception as e:
         logging.error(f"Error scraping page content from {url}: {e}")
 
     return content if content else ""
 
 def extract_title_from_link(link):
-    # Extract a title for the file from the link
-    title = link.split('=')[-1]  # Extract the ID from the link
+    # Name the file after the ID in the link, whatever order its query parameters are in
+    ids = [value for name, value in parse_qsl(urlsplit(link).query) if name.lower().endswith('id')]
+    title = ids[-1] if ids else link.split('=')[-1]
     title = title.replace('/', '_').replace('.', '').replace(',', '').replace(':', '').replace(' ', '_')
     return title
 
-def save_data(content, title, category_name):
+def save_pages(pages, category_name, base_path):
+    """
+    Save `(link, content)` pairs as they are fetched, either as one CSV file
+    per page or, with columnar storage, as a single Parquet file.
+    """
+    if use_columnar_storage():
+        records = (
+            {'category': category_name, 'link': link, 'title': extract_title_from_link(link), 'content': content}
+            for link, content in pages if content
+        )
+        save_records(base_path, os.path.join('bafin', 'BAFIN_INSTITUTION'), records, SOURCE)
+        return
+
+    metrics = get_metrics()
+    for link, content in pages:
+        if not content:
+            continue
+        title = extract_title_from_link(link)
+        with metrics.span('save', SOURCE):
+            path = save_data(content, title, category_name, base_path)
+            get_crawl_state().record_fetch(SOURCE, category_name, link, content, title, path)
+
+def save_data(content, title, category_name, base_path=None):
     # Save the scraped content to a CSV file in the specified directory
-    directory = f"uploads/current_state/bafin/BAFIN_INSTITUTION/{sanitize_filename(category_name)}"
+    base_path = base_path or os.path.join(get_uploads_dir(), 'current_state')
+    directory = os.path.join(base_path, 'bafin', 'BAFIN_INSTITUTION', sanitize_filename(category_name))
 
     # Create the directory if it doesn't exist
     os.makedirs(directory, exist_ok=True)
@@ -154,9 +298,11 @@ def save_data(content, title, category_name):
     # Define the file path
     file_path = os.path.join(directory, f"{title}.csv")
 
-    # Create a DataFrame from the content
-    df = pd.DataFrame([content])  # Assuming content can be converted to a DataFrame
+    # Create a DataFrame from the content, or from its blob reference
+    df = pd.DataFrame([content_fields(content, column=0)])
 
     # Save the DataFrame to CSV
-    df.to_csv(file_path, index=False, encoding='utf-8')
+    with replacing(file_path) as tmp_path:
+        df.to_csv(tmp_path, index=False, encoding='utf-8')
     logging.info(f"Saved data to {file_path}")
+    return record_file(file_path)
@@ -0,0 +1,136 @@
+# benchmarks/fake_webdriver.py
+import itertools
+import threading
+from urllib.parse import urljoin, urlencode
+import requests
+from bs4 import BeautifulSoup
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+from http_scraper import HTML_PARSER, form_fields
+
+_session_ids = itertools.count(1)
+
+# Number of WebDriver commands issued, each of which is a grid round-trip in production
+commands = 0
+_commands_lock = threading.Lock()
+
+def _command():
+    global commands
+    with _commands_lock:
+        commands += 1
+
+def _select(soup, by, value):
+    if by == By.ID:
+        return soup.select(f'[id="{value}"]')
+    if by == By.TAG_NAME:
+        return soup.find_all(value)
+    if by == By.CSS_SELECTOR:
+        return soup.select(value)
+    raise NotImplementedError(f"FakeWebDriver does not support locating by {by}")
+
+class FakeWebElement:
+    """
+    A WebElement backed by a BeautifulSoup tag of the current page.
+    """
+
+    def __init__(self, driver, tag):
+        self._driver = driver
+        self._tag = tag
+
+    @property
+    def text(self):
+        _command()
+        return self._tag.get_text().strip()
+
+    def get_attribute(self, name):
+        _command()
+        value = self._tag.get(name)
+        if isinstance(value, list):
+            value = ' '.join(value)
+        if name == 'href' and value is not None:
+            # Browsers report the resolved, absolute URL
+            return urljoin(self._driver._url, value)
+        return value
+
+    def find_element(self, by, value):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"No element {by}={value}")
+        return elements[0]
+
+    def find_elements(self, by, value):
+        _command()
+        return [FakeWebElement(self._driver, tag) for tag in _select(self._tag, by, value)]
+
+    def click(self):
+        _command()
+        if self._tag.name == 'option':
+            for option in self._tag.find_parent('select').find_all('option'):
+                if option.has_attr('selected'):
+                    del option['selected']
+            self._tag['selected'] = 'selected'
+        elif self._tag.name in ('button', 'input') and self._tag.find_parent('form') is not None:
+            form = self._tag.find_parent('form')
+            data = form_fields(form, {}, submit_id=self._tag.get('id'))
+            action = urljoin(self._driver._url, form.get('action') or '')
+            self._driver.get(f"{action}?{urlencode(data)}")
+
+class FakeWebDriver:
+    """
+    In-process stand-in for webdriver.Remote: pages are fetched with plain
+    HTTP and queried with BeautifulSoup, so the Selenium code paths can be
+    benchmarked without a grid or a browser.
+    """
+
+    def __init__(self, session=None):
+        self.session_id = f"fake-{next(_session_ids)}"
+        self._session = session or requests.Session()
+        self._soup = BeautifulSoup('', HTML_PARSER)
+        self._url = 'about:blank'
+        self._source = ''
+        self._status = None
+
+    def get(self, url):
+        _command()
+        # Like a browser, render error pages instead of failing the navigation
+        response = self._session.get(url, timeout=30)
+        self._url = response.url
+        self._status = response.status_code
+        self._source = response.text
+        self._soup = BeautifulSoup(response.text, HTML_PARSER)
+
+    @property
+    def current_url(self):
+        _command()
+        return self._url
+
+    @property
+    def page_source(self):
+        _command()
+        return self._source
+
+    @property
+    def title(self):
+        _command()
+        return self._soup.title.get_text() if self._soup.title else ''
+
+    def find_element(self, by, value):
+        return FakeWebElement(self, self._soup).find_element(by, value)
+
+    def find_elements(self, by, value):
+        return FakeWebElement(self, self._soup).find_elements(by, value)
+
+    def execute_script(self, script, *args):
+        _command()
+        if 'responseStatus' in script:
+            return self._status  # The navigation entry of the current page
+        raise NotImplementedError("FakeWebDriver only runs the navigation status script")
+
+    def implicitly_wait(self, seconds):
+        pass
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def quit(self):
+        pass
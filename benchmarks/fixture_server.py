@@ -0,0 +1,159 @@
+# benchmarks/fixture_server.py
+import threading
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Category names the FMA scraper filters on, plus one it should ignore
+FMA_CATEGORIES = [
+    ('1', 'Banks - Banks licensed in Austria'),
+    ('2', 'Payment institutions - Account information service provider (AISP)'),
+    ('3', 'Payment institutions - Payment initiation service provider (PISP)'),
+    ('4', 'Insurance undertakings')
+]
+BAFIN_COMPANY_CATEGORIES = [('10', 'Kreditinstitute'), ('11', 'Finanzdienstleistungsinstitute')]
+BAFIN_INSTITUTION_CATEGORIES = [('20', 'Zahlungsinstitute'), ('21', 'E-Geld-Institute')]
+
+FMA_PER_PAGE = 10
+
+def _page(title, body):
+    return f"<!DOCTYPE html><html><head><title>{escape(title)}</title></head><body>{body}</body></html>"
+
+def _options(select_id, categories, name=None):
+    options = ''.join(f'<option value="{value}">{escape(label)}</option>' for value, label in categories)
+    return f'<select id="{select_id}" name="{name or select_id}"><option value="">--</option>{options}</select>'
+
+def _filler(record_id, size):
+    # Deterministic body text so page sizes resemble real detail pages
+    sentence = f"Record {record_id} is registered with the supervisory authority. "
+    return f"<p>{sentence * max(1, size // len(sentence))}</p>"
+
+class FixtureSite:
+    """
+    Generates pages that reproduce the markup the scrapers depend on: BaFin
+    displaytag listings, the ZahlInstInfo search form and result pages, FMA
+    listings and plain simple-site pages, for a register of `records` entries
+    per category. With `shared_fma_links` every FMA category lists the same
+    detail pages, as entities registered for several services are.
+    """
+
+    def __init__(self, records=1000, page_size=100, detail_size=20000, shared_fma_links=False):
+        self.records = records
+        self.shared_fma_links = shared_fma_links
+        self.page_size = page_size
+        self.detail_size = detail_size
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def count(self, body):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += len(body)
+
+    def render(self, path, query):
+        if path.startswith('/simple/'):
+            record_id = path.rsplit('/', 1)[-1]
+            return _page(f"Simple page {record_id}", _filler(record_id, self.detail_size))
+        if path == '/bafin/sucheForm.do':
+            return self.bafin_company_listing(query)
+        if path == '/bafin/detail.do':
+            record_id = query.get('id', ['0'])[0]
+            body = f'<div id="wrapperContent"><div id="content"><p><strong>Company {record_id} AG</strong></p>{_filler(record_id, self.detail_size)}</div></div>'
+            return _page(f"Company {record_id}", body)
+        if path.rstrip('/') in ('/zahlinst', '/zahlinst/suche.do'):  # The register's start page is its search form
+            form = (
+                '<form action="result.do" method="get">'
+                f'{_options("filterObjektart", BAFIN_INSTITUTION_CATEGORIES)}'
+                '<input type="hidden" name="locale" value="de_DE">'
+                '<button type="submit" id="nameZahlungsinstitutButton" name="sucheButton" value="Suche">Suche</button>'
+                '</form>'
+            )
+            return _page("Zahlungsinstitute", form)
+        if path == '/zahlinst/result.do':
+            return self.bafin_institution_listing(query)
+        if path == '/zahlinst/institutDetails.do':
+            record_id = query.get('id', ['0'])[0]
+            return _page(f"Institut {record_id}", _filler(record_id, self.detail_size))
+        if path.rstrip('/') == '/fma':
+            return self.fma_listing(query)
+        if path.startswith('/fma/detail/'):
+            record_id = path.rsplit('/', 1)[-1]
+            return _page(f"FMA entity {record_id}", _filler(record_id, self.detail_size))
+        return None
+
+    def _page_rows(self, page_number, page_size):
+        start = (page_number - 1) * page_size
+        return range(start, min(start + page_size, self.records))
+
+    def bafin_company_listing(self, query):
+        category_id = query.get('kategorieId', [''])[0]
+        page_number = int(query.get('d-4012550-p', ['1'])[0])
+        rows = ''.join(
+            f'<tr><td><a href="detail.do?id={category_id}-{i}&amp;locale=en_GB">Company {i}</a></td></tr>'
+            for i in self._page_rows(page_number, self.page_size)
+        )
+        links = ''
+        if page_number * self.page_size < self.records:
+            links = f'<span class="pagelinks"><a href="sucheForm.do?d-4012550-p={page_number + 1}">Next</a></span>'
+        body = f'{_options("institutKategorie", BAFIN_COMPANY_CATEGORIES)}<table><tbody>{rows}</tbody></table>{links}'
+        return _page("Unternehmensdatenbank", body)
+
+    def bafin_institution_listing(self, query):
+        category_id = query.get('filterObjektart', [''])[0]
+        page_number = int(query.get('page', ['1'])[0])
+        rows = ''.join(
+            f'<tr><td><a href="/zahlinst/institutDetails.do?id={category_id}-{i}">Institut {i}</a></td></tr>'
+            for i in self._page_rows(page_number, self.page_size)
+        )
+        links = ''
+        if page_number * self.page_size < self.records:
+            next_page = page_number + 1
+            links = f'<a title="zum Abschnitt {next_page}" href="result.do?filterObjektart={category_id}&amp;page={next_page}">{next_page}</a>'
+        return _page("Zahlungsinstitute", f'<table><tbody>{rows}</tbody></table>{links}')
+
+    def fma_listing(self, query):
+        select = _options('category', FMA_CATEGORIES)
+        if 'category' not in query:
+            return _page("FMA company database", select)
+        category_id = query['category'][0]
+        page_number = int(query.get('to', ['1'])[0])
+        prefix = '' if self.shared_fma_links else f'{category_id}-'
+        links = ''.join(
+            f'<div class="print-view-button-wrap"><a href="/fma/detail/{prefix}{i}">Print</a></div>'
+            for i in self._page_rows(page_number, FMA_PER_PAGE)
+        )
+        disabled = '' if page_number * FMA_PER_PAGE < self.records else ' disabled'
+        pager = f'<ul><li class="copy next"><a class="next{disabled}" href="#">Next</a></li></ul>'
+        return _page("FMA company database", f'{select}{links}{pager}')
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real sites
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        body = self.server.site.render(parsed.path, parse_qs(parsed.query))
+        if body is None:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.server.site.count(data)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fixture_server(site, host='127.0.0.1', port=0):
+    """
+    Serve `site` from a background thread and return the server; its base
+    URL is `http://{host}:{server.server_port}`.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.site = site
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,379 @@
+# benchmarks/run_benchmarks.py
+"""
+Offline throughput benchmarks for the scrapers.
+
+Runs every scraper against a local fixture site, with the Selenium paths
+driven by an in-process fake WebDriver, compares the per-page parsing cost
+with the previous full-tree parsing, and times snapshot diffing for
+registers of several sizes. It exits non-zero if a scraper fetched no
+pages, if re-running an unchanging site reports changes, or if Slack
+notifications are not retried and batched as configured:
+
+    python -m benchmarks.run_benchmarks --records 1000 --diff-records 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fixture_server import FixtureSite, start_fixture_server  # noqa: E402
+from benchmarks.webhook_server import FakeWebhook, start_webhook_server  # noqa: E402
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def configure_environment(args, work_dir, base_url):
+    # The scrapers read their configuration from the environment; the .env
+    # file is never loaded here
+    os.environ.update({
+        'SCRAPE_MODE': args.mode,
+        'FMA_URL': f"{base_url}/fma/",
+        'BAFIN_DB_COMPANY': f"{base_url}/bafin",
+        'BAFIN_INSTITUTION': f"{base_url}/zahlinst",
+        'SELENIUM_POOL_SIZE': str(args.sessions),
+        'SIMPLE_MAX_WORKERS': str(args.sessions),
+        'SIMPLE_PER_HOST_LIMIT': str(args.sessions),
+        'HTTP_PER_HOST_LIMIT': str(args.sessions),
+        'POLITENESS_INITIAL_RATE': '100000',
+        'POLITENESS_MAX_RATE': '100000',
+        'POLITENESS_BURST': '1000',
+        'CRAWL_STATE_PATH': os.path.join(work_dir, 'crawl_state.sqlite3'),
+        'HTTP_CACHE_PATH': os.path.join(work_dir, 'http_cache.json'),
+        'BLOB_STORE_PATH': os.path.join(work_dir, 'blobs'),
+        'UPLOADS_DIR': work_dir
+    })
+
+def measure(site, name, records, fn):
+    from benchmarks import fake_webdriver
+
+    requests_before, bytes_before = site.requests, site.bytes_sent
+    commands_before = fake_webdriver.commands
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    pages = site.requests - requests_before
+    return {
+        'benchmark': name,
+        'records': records,
+        'pages': pages,
+        'webdriver_commands': fake_webdriver.commands - commands_before,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(pages / elapsed, 1) if elapsed else None,
+        'mb_fetched': round((site.bytes_sent - bytes_before) / 1e6, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'ok': pages > 0  # A scraper that fetched nothing measured nothing
+    }
+
+def use_fake_drivers():
+    # Serve browser sessions from the fake driver
+    import driver_pool
+    from benchmarks.fake_webdriver import FakeWebDriver
+    driver_pool.create_driver = lambda profile=None: FakeWebDriver()
+
+def run_scraper_benchmarks(args, site, base_url, work_dir):
+    import bafin_institution_scraper
+    from fetch_engine import FetchEngine
+    from simple_scraper import scrape_simple_site
+    from fma_scraper import scrape_fma_site, save_data as save_fma_data
+    from bafin_company_scraper import scrape_bafin_company, save_data as save_bafin_company_data
+
+    # Point the ZahlInstInfo search at the fixture
+    use_fake_drivers()
+    bafin_institution_scraper.SEARCH_URL = f"{base_url}/zahlinst/suche.do"
+
+    def snapshot_dir(name):
+        return os.path.join(work_dir, 'snapshots', name)
+
+    def simple():
+        engine = FetchEngine()
+        urls = [f"{base_url}/simple/{i}" for i in range(args.records)]
+        for _ in engine.fetch_all(urls, scrape_simple_site):
+            pass
+
+    def fma():
+        save_fma_data(scrape_fma_site(f"{base_url}/fma/"), snapshot_dir('fma'))
+
+    def bafin_company():
+        save_bafin_company_data(scrape_bafin_company(f"{base_url}/bafin", '10'), snapshot_dir('bafin_company'))
+
+    def bafin_institution():
+        bafin_institution_scraper.scrape_bafin_institution(f"{base_url}/zahlinst", '20', snapshot_dir('bafin_institution'))
+
+    benchmarks = {
+        'scrape_simple_site': simple,
+        'scrape_fma_site': fma,
+        'scrape_bafin_company': bafin_company,
+        'scrape_bafin_institution': bafin_institution
+    }
+    return [
+        measure(site, name, args.records, fn)
+        for name, fn in benchmarks.items()
+        if not args.only or name in args.only
+    ]
+
+def run_rerun_check(args, work_dir, runs=3):
+    """
+    Crawl an unchanging FMA fixture, whose categories all list the same
+    detail pages, through the full runner with incremental crawling, and
+    record the notifications of every run after the first; there must be
+    none. In Selenium mode the run report must also cover the sessions.
+    """
+    import scraper.runner as runner
+    from crawl_state import get_crawl_state
+    from metrics import get_metrics
+
+    site = FixtureSite(records=min(args.records, 30), detail_size=1000, shared_fma_links=True)
+    server = start_fixture_server(site)
+    os.environ.update({
+        'FMA_URL': f"http://127.0.0.1:{server.server_port}/fma/",
+        'FMA_CATEGORIES': 'all',
+        'UPLOADS_DIR': os.path.join(work_dir, 'rerun')
+    })
+    use_fake_drivers()
+    get_crawl_state().incremental = True  # The store is already open, so switch it over directly
+
+    notifications = []
+    runner.send_slack_notification = lambda message, source=None: notifications.append(message)
+    counts = []
+    sessions = []
+    try:
+        for _ in range(runs):
+            del notifications[:]
+            runner.run(['fma'])
+            counts.append(len(notifications))
+            # What the report written at the end of the run says about the sessions
+            sessions.append(sum(
+                histogram['count'] for histogram in get_metrics().report()['histograms']
+                if histogram['name'] == 'webdriver_session_lifetime_seconds'
+            ))
+    finally:
+        server.shutdown()
+    return [{
+        'check': 'rerun_unchanged_site',
+        'runs': runs,
+        'notifications_per_run': counts,
+        'sessions_reported_per_run': sessions,
+        'ok': not any(counts[1:]) and (args.mode != 'selenium' or all(sessions)),
+        'last_run_notifications': notifications[:5]
+    }]
+
+def run_notifier_check():
+    """
+    Send notifications through NotificationDispatcher to a local stand-in
+    webhook: a post answered with 429 and Retry-After, then with 500, must
+    be retried until it goes through, waiting as long as Retry-After asks;
+    a 400 must not be retried; and digests must be combined per source and
+    split into chunks Slack does not truncate.
+    """
+    from notifier import NotificationDispatcher, MAX_MESSAGE_LENGTH
+
+    retry_after = 2
+    webhook = FakeWebhook([(429, {'Retry-After': str(retry_after)}), (500, {}), (200, {}), (400, {})])
+    server = start_webhook_server(webhook)
+    url = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        dispatcher = NotificationDispatcher(url, mode='immediate', max_retries=3)
+        dispatcher.notify('retried')
+        dispatcher.notify('rejected')
+        dispatcher.close()
+        posts = list(webhook.posts)
+
+        webhook.posts.clear()
+        dispatcher = NotificationDispatcher(url, mode='digest_per_source', max_retries=3)
+        long_messages = [f"Difference found in bafin/record-{i}.csv " + 'x' * 200 for i in range(40)]
+        for message in long_messages:
+            dispatcher.notify(message, 'bafin')
+        dispatcher.notify('New entry found: fma/a.csv', 'fma')
+        dispatcher.notify('Entry removed: fma/b.csv', 'fma')
+        dispatcher.close()
+        digests = webhook.texts
+    finally:
+        server.shutdown()
+
+    # The first post is retried after Retry-After, the second after the backoff
+    statuses = [status for _, _, status in posts]
+    waited = posts[1][0] - posts[0][0] if len(posts) > 1 else 0
+    retried_ok = [text for _, text, _ in posts] == ['retried', 'retried', 'retried', 'rejected'] and statuses == [429, 500, 200, 400]
+    fma_digests = [text for text in digests if text.startswith('2 change(s) found in fma')]
+    bafin_digests = [text for text in digests if text not in fma_digests]
+    digest_ok = (
+        fma_digests == ['2 change(s) found in fma\nNew entry found: fma/a.csv\nEntry removed: fma/b.csv']
+        and len(bafin_digests) > 1  # Too long for one message
+        and '\n'.join(bafin_digests) == '\n'.join(['40 change(s) found in bafin'] + long_messages)
+        and all(len(text) <= MAX_MESSAGE_LENGTH for text in digests)
+    )
+    return [{
+        'check': 'notifier_retry',
+        'posts': len(posts),
+        'statuses': statuses,
+        'retry_after_seconds': retry_after,
+        'waited_seconds': round(waited, 2),
+        'ok': retried_ok and waited >= retry_after
+    }, {
+        'check': 'notifier_digest',
+        'posts': len(digests),
+        'longest_post': max((len(text) for text in digests), default=0),
+        'ok': digest_ok
+    }]
+
+def run_parse_benchmarks(site, pages):
+    """
+    Per-page CPU time of the title extraction and simple-site capture,
+    against the full html.parser tree they used to build.
+    """
+    import contextlib
+    import io
+    import requests
+    from bs4 import BeautifulSoup
+    import bafin_company_scraper
+    import fma_scraper
+    import simple_scraper
+
+    class PageSession:
+        # Answers every request with the page being timed, so the capture
+        # runs through the real request path without touching the network
+        html = ''
+
+        def request(self, method, url, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response.url = url
+            response.encoding = 'utf-8'
+            response._content = self.html.encode('utf-8')
+            return response
+
+    session = PageSession()
+
+    def simple_capture(html):
+        session.html = html
+        with contextlib.redirect_stdout(io.StringIO()):
+            return simple_scraper.scrape_simple_site('http://simple.invalid/page', session)
+
+    def legacy_fma_title(html):
+        return BeautifulSoup(html, 'html.parser').title.string.strip()
+
+    def legacy_bafin_company_title(html):
+        soup = BeautifulSoup(html, 'html.parser')
+        return soup.find('div', id='wrapperContent').find('div', id='content').find('p').find('strong').text.strip()
+
+    def legacy_simple_capture(html):
+        # The capture used to round-trip the page through html.parser
+        data = simple_capture(html)
+        data['html_content'] = str(BeautifulSoup(data['html_content'], 'html.parser'))
+        return data
+
+    fma_pages = [site.render(f'/fma/detail/1-{i}', {}) for i in range(pages)]
+    bafin_pages = [site.render('/bafin/detail.do', {'id': [f'10-{i}']}) for i in range(pages)]
+    simple_pages = [site.render(f'/simple/{i}', {}) for i in range(pages)]
+    cases = [
+        ('fma_title', fma_pages, legacy_fma_title, fma_scraper.extract_title),
+        ('bafin_company_title', bafin_pages, legacy_bafin_company_title, bafin_company_scraper.extract_title),
+        ('simple_capture', simple_pages, legacy_simple_capture, simple_capture)
+    ]
+
+    results = []
+    for name, html_pages, legacy, current in cases:
+        timings = {}
+        for label, fn in (('legacy', legacy), ('current', current)):
+            start = time.process_time()
+            for html in html_pages:
+                fn(html)
+            timings[label] = (time.process_time() - start) / len(html_pages)
+        results.append({
+            'benchmark': f'parse_{name}',
+            'pages': len(html_pages),
+            'legacy_cpu_ms_per_page': round(timings['legacy'] * 1000, 3),
+            'current_cpu_ms_per_page': round(timings['current'] * 1000, 3),
+            'speedup': round(timings['legacy'] / timings['current'], 1) if timings['current'] else None
+        })
+    return results
+
+def run_diff_benchmarks(sizes):
+    import pandas as pd
+    from manifest import Manifest, diff_manifests
+    from snapshot_store import diff_snapshots
+
+    results = []
+    rng = random.Random(0)
+    for size in sizes:
+        # Two runs of a register where 1% of the entries changed, 0.5% were
+        # delisted and 0.5% are new
+        old = {f"fma/category/record-{i}.csv": {'digest': f"{i:064x}", 'size': 1, 'mtime': 0} for i in range(size)}
+        new = dict(old)
+        for i in rng.sample(range(size), max(1, size // 100)):
+            new[f"fma/category/record-{i}.csv"] = {'digest': f"{i + size:064x}", 'size': 1, 'mtime': 0}
+        for i in rng.sample(range(size), max(1, size // 200)):
+            new.pop(f"fma/category/record-{i}.csv", None)
+        for i in range(size, size + max(1, size // 200)):
+            new[f"fma/category/record-{i}.csv"] = {'digest': f"{i:064x}", 'size': 1, 'mtime': 0}
+
+        start = time.perf_counter()
+        diff_manifests(Manifest('old', old), Manifest('new', new))
+        manifest_seconds = time.perf_counter() - start
+
+        to_frame = lambda entries: pd.DataFrame({
+            'link': list(entries),
+            'digest': [entry['digest'] for entry in entries.values()]
+        })
+        old_df, new_df = to_frame(old), to_frame(new)
+        start = time.perf_counter()
+        diff_snapshots(old_df, new_df)
+        columnar_seconds = time.perf_counter() - start
+
+        results.append({
+            'benchmark': 'diff',
+            'records': size,
+            'manifest_diff_seconds': round(manifest_seconds, 4),
+            'columnar_diff_seconds': round(columnar_seconds, 4),
+            'peak_rss_mb': round(peak_rss_mb(), 1)
+        })
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=1000, help='register size per category for the scraper runs')
+    parser.add_argument('--page-size', type=int, default=100, help='rows per BaFin listing page')
+    parser.add_argument('--detail-size', type=int, default=20000, help='approximate size of a detail page in bytes')
+    parser.add_argument('--sessions', type=int, default=4, help='concurrent sessions / connections per host')
+    parser.add_argument('--mode', choices=['selenium', 'http'], default='selenium', help='scrape mode for BaFin and FMA')
+    parser.add_argument('--diff-records', type=int, nargs='*', default=[1000, 10000, 100000], help='register sizes for the diff benchmark')
+    parser.add_argument('--parse-pages', type=int, default=200, help='detail pages for the parsing benchmark')
+    parser.add_argument('--only', nargs='*', help='run only these scraper benchmarks')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='scraper-bench-')
+    site = FixtureSite(records=args.records, page_size=args.page_size, detail_size=args.detail_size)
+    server = start_fixture_server(site)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    configure_environment(args, work_dir, base_url)
+    os.chdir(work_dir)  # Keep the scrapers' log file out of the repository
+    from utils import configure_logging
+    configure_logging()
+
+    results = run_scraper_benchmarks(args, site, base_url, work_dir) if args.records else []
+    results += run_parse_benchmarks(site, args.parse_pages) if args.parse_pages else []
+    results += run_diff_benchmarks(args.diff_records)
+    server.shutdown()
+    results += run_rerun_check(args, work_dir) if args.records else []
+    results += run_notifier_check()
+
+    for result in results:
+        print(json.dumps(result))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    failed = [result.get('check') or result['benchmark'] for result in results if result.get('ok') is False]
+    if failed:
+        sys.exit(f"Failed: {', '.join(failed)}")
+
+if __name__ == '__main__':
+    main()
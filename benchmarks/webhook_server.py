@@ -0,0 +1,57 @@
+# benchmarks/webhook_server.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class FakeWebhook:
+    """
+    Stand-in for a Slack incoming webhook: records every post and answers
+    it with the next of the scripted `(status, headers)` responses, or with
+    200 once they have run out.
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.posts = []  # (monotonic time, text, status)
+        self._lock = threading.Lock()
+
+    def answer(self, text):
+        with self._lock:
+            status, headers = self.responses.pop(0) if self.responses else (200, {})
+            self.posts.append((time.monotonic(), text, status))
+        return status, headers
+
+    @property
+    def texts(self):
+        with self._lock:
+            return [text for _, text, _ in self.posts]
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        status, headers = self.server.webhook.answer(payload.get('text'))
+        body = b'ok' if status < 400 else b'error'
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_webhook_server(webhook, host='127.0.0.1', port=0):
+    """
+    Serve `webhook` from a background thread and return the server; its URL
+    is `http://{host}:{server.server_port}/`.
+    """
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.webhook = webhook
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,87 @@
+# blob_store.py
+import gzip
+import os
+import threading
+from http_cache import body_digest
+from utils import get_blob_store_enabled, get_blob_store_path, get_blob_compression
+
+# zstd is optional; fall back to gzip when the zstandard package is missing
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class BlobStore:
+    """
+    Content-addressed store for raw page HTML. Each distinct page is written
+    once, compressed, under the SHA-256 of its UTF-8 bytes, so storing an
+    unchanged page again costs nothing.
+    """
+
+    def __init__(self, root=None, compression=None):
+        self.root = root or get_blob_store_path()
+        compression = compression or get_blob_compression()
+        self.compression = 'zstd' if compression == 'zstd' and zstandard else 'gzip'
+        self._lock = threading.Lock()
+
+    def _path(self, sha256, compression):
+        extension = 'zst' if compression == 'zstd' else 'gz'
+        return os.path.join(self.root, sha256[:2], f"{sha256}.html.{extension}")
+
+    def _compress(self, data):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor().compress(data)
+        return gzip.compress(data, mtime=0)
+
+    def put(self, content):
+        """
+        Store `content` if it is not stored yet and return its SHA-256.
+        """
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        sha256 = body_digest(data)
+        path = self._path(sha256, self.compression)
+        if os.path.exists(path):
+            return sha256
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(self._compress(data))
+        os.replace(tmp_path, path)
+        return sha256
+
+    def get(self, sha256):
+        """
+        Return the decoded content stored under `sha256`.
+        """
+        gzip_path = self._path(sha256, 'gzip')
+        if os.path.exists(gzip_path):
+            with gzip.open(gzip_path, 'rb') as f:
+                return f.read().decode('utf-8')
+        if zstandard is None:
+            raise FileNotFoundError(f"No gzip blob for {sha256} and zstandard is not installed")
+        with open(self._path(sha256, 'zstd'), 'rb') as f:
+            return zstandard.ZstdDecompressor().decompressobj().decompress(f.read()).decode('utf-8')
+
+    def exists(self, sha256):
+        return os.path.exists(self._path(sha256, 'gzip')) or os.path.exists(self._path(sha256, 'zstd'))
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+        return _store
+
+def content_fields(content, column='content'):
+    """
+    Return the record fields for a page's HTML: the HTML itself under
+    `column`, or its blob reference under `content_sha256` when the blob
+    store is enabled.
+    """
+    if get_blob_store_enabled():
+        return {'content_sha256': get_blob_store().put(content)}
+    return {column: content}
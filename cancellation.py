@@ -0,0 +1,99 @@
+# cancellation.py
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+class Cancelled(Exception):
+    """
+    Raised at the next checkpoint once a source has been cancelled or has
+    run out of its time budget.
+    """
+
+class CancelToken:
+    """
+    Cooperative cancellation for one source. Work is never interrupted
+    mid-call; instead page loads and requests check the token before they
+    start and give up with Cancelled once it is cancelled or past its
+    deadline.
+    """
+
+    def __init__(self, name, budget=None):
+        self.name = name
+        self.deadline = time.monotonic() + budget if budget else None
+        self.reason = None
+        self._cancelled = threading.Event()
+
+    def cancel(self, reason='cancelled'):
+        if self.reason is None:
+            self.reason = reason
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        if self.deadline is not None and time.monotonic() >= self.deadline and not self._cancelled.is_set():
+            self.cancel('time budget exceeded')
+        return self._cancelled.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled(f"{self.name} was cancelled: {self.reason}")
+
+    def wait(self, timeout):
+        """
+        Wait up to `timeout` seconds, returning True as soon as the token is
+        cancelled or reaches its deadline.
+        """
+        if self.deadline is not None:
+            timeout = min(timeout, max(0, self.deadline - time.monotonic()))
+        self._cancelled.wait(timeout)
+        return self.cancelled
+
+_local = threading.local()
+
+def current_token():
+    return getattr(_local, 'token', None)
+
+@contextmanager
+def use_token(token):
+    """
+    Make `token` the current thread's cancellation token inside the block.
+    """
+    previous = current_token()
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+def bind_token(fn):
+    """
+    Wrap `fn` so that it runs with the calling thread's token, for work
+    handed to helper threads.
+    """
+    token = current_token()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with use_token(token):
+            return fn(*args, **kwargs)
+    return wrapper
+
+def sleep(seconds):
+    """
+    Sleep for `seconds`, but raise Cancelled as soon as the current
+    thread's source is cancelled instead of sleeping on.
+    """
+    token = current_token()
+    if token is None:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        token.check()
+
+def check_cancelled():
+    """
+    Raise Cancelled if the current thread's source has been cancelled.
+    """
+    token = current_token()
+    if token is not None:
+        token.check()
@@ -0,0 +1,85 @@
+# categories.py
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cancellation import Cancelled, bind_token
+from metrics import get_metrics
+from utils import get_category_workers
+
+# Selects every category offered by the source's category <select>
+ALL = 'all'
+
+class IncompleteListing(Exception):
+    """
+    Raised when a listing page that the previous page announced holds no
+    entries, e.g. a maintenance page served with status 200. Diffing the
+    listing without the remaining pages would report them as removed.
+    """
+
+def parse_selection(value):
+    """
+    Parse a category setting: 'all', or a comma-separated list of category
+    IDs (or, for FMA, names). Returns ALL, a list, or None if unset.
+    """
+    if not value or not value.strip():
+        return None
+    if value.strip().lower() == ALL:
+        return ALL
+    return [category.strip() for category in value.split(',') if category.strip()]
+
+def parse_options(soup, select):
+    """
+    Return `(value, label)` for every option of the `select` element that
+    has a value, skipping placeholders such as 'Please select'.
+    """
+    return [
+        (option.get('value'), option.get_text().strip())
+        for option in soup.select(f'{select} option')
+        if option.get('value') and option.get('value').strip()
+    ]
+
+def crawl_categories(source, categories, crawl_fn, workers=None):
+    """
+    Call `crawl_fn(category_id, category_name)` for every `(id, name)` in
+    `categories`, several at a time. The categories share the source's
+    driver pool, so one run covers them all on the same warm sessions.
+
+    A failing category does not stop the others; once all have finished,
+    the first error is re-raised so the source's previous state is kept
+    for the categories that did not complete.
+    """
+    categories = list(categories)
+    if not categories:
+        logging.warning(f"No categories selected for {source}.")
+        return
+    workers = max(1, min(workers or get_category_workers(source), len(categories)))
+    metrics = get_metrics()
+    logging.info(f"Crawling {len(categories)} {source} categories, {workers} at a time.")
+
+    def crawl(category_id, category_name):
+        start = time.monotonic()
+        logging.info(f"Started {source} category {category_name or category_id}.")
+        crawl_fn(category_id, category_name)
+        return time.monotonic() - start
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{source}-category") as executor:
+        futures = {executor.submit(bind_token(crawl), category_id, category_name): category_name or category_id for category_id, category_name in categories}
+        for done, future in enumerate(as_completed(futures), 1):
+            label = futures[future]
+            try:
+                seconds = future.result()
+            except Cancelled as e:
+                errors.append(e)
+                metrics.inc('categories_total', source=source, status='cancelled')
+                logging.warning(f"{source} category {label} was cancelled ({done}/{len(categories)}).")
+            except Exception as e:
+                errors.append(e)
+                metrics.inc('categories_total', source=source, status='failed')
+                logging.error(f"{source} category {label} failed ({done}/{len(categories)}): {e}")
+            else:
+                metrics.inc('categories_total', source=source, status='ok')
+                logging.info(f"Finished {source} category {label} in {seconds:.0f}s ({done}/{len(categories)}).")
+
+    if errors:
+        raise next((e for e in errors if isinstance(e, Cancelled)), errors[0])
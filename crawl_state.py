@@ -0,0 +1,227 @@
+# crawl_state.py
+import logging
+import math
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from http_cache import body_digest
+from cancellation import check_cancelled
+from urls import canonical_url
+from utils import get_crawl_state_path, get_incremental_crawl, get_crawl_reverify_fraction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    source TEXT NOT NULL,
+    category TEXT NOT NULL,
+    url TEXT NOT NULL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL,
+    last_fetched TEXT,
+    digest TEXT,
+    title TEXT,
+    path TEXT,
+    missing INTEGER NOT NULL DEFAULT 0,
+    deferred INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, category, url)
+)
+"""
+
+COLUMNS = "source, category, url, first_seen, last_seen, last_fetched, digest, title, path, missing, deferred"
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+class CrawlState:
+    """
+    Persistent record of every detail page we have seen, keyed by source,
+    category and canonical URL, since one detail page may be listed under several
+    categories and is stored once per category: when it was first and last
+    listed, when it was last fetched, the digest of its
+    content, its title and where it is stored in the snapshot.
+
+    With incremental crawling enabled, `plan` only returns newly listed URLs,
+    URLs deferred by a failed fetch in an earlier run, and a slice of the
+    known ones that have gone longest without a fetch; the remaining known
+    pages are carried over from the previous snapshot.
+    """
+
+    def __init__(self, path=None, incremental=None, reverify_fraction=None):
+        self.path = path or get_crawl_state_path()
+        self.incremental = get_incremental_crawl() if incremental is None else incremental
+        self.reverify_fraction = get_crawl_reverify_fraction() if reverify_fraction is None else reverify_fraction
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(SCHEMA)
+        self._migrate()
+        self._conn.commit()
+        self._skipped = set()
+        self._pending = set()
+
+    def _migrate(self):
+        columns = {row[1]: row[5] for row in self._conn.execute("PRAGMA table_info(pages)")}
+        if 'deferred' not in columns:
+            self._conn.execute("ALTER TABLE pages ADD COLUMN deferred INTEGER NOT NULL DEFAULT 0")
+        if columns.get('source'):
+            return
+        # Older stores were keyed by URL alone; their rows keep the one
+        # category they were last listed under
+        self._conn.execute("ALTER TABLE pages RENAME TO pages_by_url")
+        self._conn.execute(SCHEMA)
+        self._conn.execute(f"INSERT INTO pages ({COLUMNS}) SELECT {COLUMNS} FROM pages_by_url")
+        self._conn.execute("DROP TABLE pages_by_url")
+
+    def clear(self, sources=None):
+        """
+        Forget every page, or only those of `sources`.
+        """
+        with self._lock:
+            if sources is None:
+                self._conn.execute("DELETE FROM pages")
+            else:
+                self._conn.executemany("DELETE FROM pages WHERE source = ?", [(source,) for source in sources])
+            self._conn.commit()
+            self._skipped -= {key for key in self._skipped if sources is None or key[0] in sources}
+            self._pending -= {key for key in self._pending if sources is None or key[0] in sources}
+
+    def plan(self, source, category, urls):
+        """
+        Record that `urls` are listed under `source` / `category` and return
+        the ones that should be fetched this run. Known URLs of the category
+        that are no longer listed are flagged as missing. URLs are compared
+        by their canonical form, but returned as given, for fetching.
+
+        Raises Cancelled if the calling source has been cancelled, since its
+        listing may have been cut short.
+        """
+        check_cancelled()
+        listed_urls = {}
+        for url in urls:
+            listed_urls.setdefault(canonical_url(url), url)
+        urls = list(listed_urls)
+        if not urls:
+            return []
+        now = _now()
+
+        with self._lock:
+            known = {}
+            deferred = set()
+            for url, last_fetched, is_deferred in self._conn.execute(
+                "SELECT url, last_fetched, deferred FROM pages WHERE source = ? AND category = ? AND path IS NOT NULL AND missing = 0",
+                (source, category)
+            ):
+                known[url] = last_fetched
+                if is_deferred:
+                    deferred.add(url)
+
+            self._conn.executemany(
+                "INSERT INTO pages (source, category, url, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(source, category, url) DO UPDATE SET last_seen = excluded.last_seen, missing = 0",
+                [(source, category, url, now, now) for url in urls]
+            )
+
+            listed = set(urls)
+            disappeared = [
+                row[0] for row in self._conn.execute(
+                    "SELECT url FROM pages WHERE source = ? AND category = ? AND missing = 0 AND last_seen < ?",
+                    (source, category, now)
+                )
+                if row[0] not in listed
+            ]
+            self._conn.executemany(
+                "UPDATE pages SET missing = 1 WHERE source = ? AND category = ? AND url = ?",
+                [(source, category, url) for url in disappeared]
+            )
+            self._conn.commit()
+
+        for url in disappeared:
+            logging.info(f"Link no longer listed in {source} / {category}: {url}")
+
+        if not self.incremental:
+            with self._lock:
+                self._pending.update((source, category, url) for url in urls)
+            return list(listed_urls.values())
+
+        new_urls = [url for url in urls if url not in known or url in deferred]
+        known_urls = sorted((url for url in urls if url in known and url not in deferred), key=lambda url: known[url] or '')
+        reverify_count = math.ceil(len(known_urls) * self.reverify_fraction)
+        to_fetch = new_urls + known_urls[:reverify_count]
+        skipped = known_urls[reverify_count:]
+        with self._lock:
+            self._skipped.update((source, category, url) for url in skipped)
+            self._pending.update((source, category, url) for url in to_fetch)
+
+        logging.info(f"{source} / {category}: {len(new_urls)} new or deferred, {reverify_count} re-verified, {len(skipped)} unchanged links.")
+        return [listed_urls[url] for url in to_fetch]
+
+    def record_fetch(self, source, category, url, content, title, path, digest=None):
+        """
+        Record a page fetched for `source` / `category`, its title and its
+        path in the snapshot. Pass `digest` instead of `content` when the
+        content is no longer at hand.
+        """
+        key = (source, category, canonical_url(url))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE pages SET last_fetched = ?, digest = ?, title = ?, path = ?, deferred = 0 "
+                "WHERE source = ? AND category = ? AND url = ?",
+                (_now(), digest or body_digest(content or ''), title, path) + key
+            )
+            self._conn.commit()
+            self._skipped.discard(key)
+            self._pending.discard(key)
+
+    def forget(self, source, category, url):
+        """
+        Drop the stored path of `url` in `source` / `category` so it is
+        fetched again next run.
+        """
+        url = canonical_url(url)
+        with self._lock:
+            self._conn.execute("UPDATE pages SET path = NULL WHERE source = ? AND category = ? AND url = ?", (source, category, url))
+            self._conn.commit()
+
+    def unfetched_pages(self, sources=None):
+        """
+        Return `(source, category, canonical url, path)` for every known page that was
+        skipped or whose fetch failed this run, so its stored file can be
+        carried over from the previous snapshot. Failed pages are deferred
+        to the next run. With `sources`, only their pages are returned,
+        leaving those of runs still in progress alone.
+        """
+        with self._lock:
+            skipped = [key for key in self._skipped if sources is None or key[0] in sources]
+            failed = [key for key in self._pending if sources is None or key[0] in sources]
+            self._conn.executemany("UPDATE pages SET deferred = 1 WHERE source = ? AND category = ? AND url = ?", failed)
+            self._conn.commit()
+            if failed:
+                logging.warning(f"Deferring {len(failed)} pages that could not be fetched to the next run.")
+
+            rows = []
+            for key in skipped + failed:
+                row = self._conn.execute("SELECT path FROM pages WHERE source = ? AND category = ? AND url = ?", key).fetchone()
+                if row and row[0]:
+                    rows.append(key + (row[0],))
+            self._skipped.difference_update(skipped)
+            self._pending.difference_update(failed)
+        return rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_state = None
+_state_lock = threading.Lock()
+
+def get_crawl_state():
+    """
+    Return the process-wide crawl state store, opening it on first use.
+    """
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = CrawlState()
+        return _state
@@ -0,0 +1,99 @@
+# detail_fetcher.py
+import logging
+import queue
+import threading
+from driver_pool import get_driver_pool
+from utils import get_selenium_detail_workers, get_distributed_crawl
+from cancellation import bind_token
+from work_queue import fetch_queued, task_name
+
+_DONE = object()
+
+def _worker(pool, work, results, stop, fetch_fn):
+    item = work.get()
+    while item is not _DONE:
+        if stop.is_set():
+            # The consumer has gone away; drain the remaining items unfetched
+            item = work.get()
+            continue
+        try:
+            # Hold one session until an item fails on it, then hand it back so
+            # the pool can recycle it and carry on with a fresh one
+            with pool.lease() as driver:
+                while item is not _DONE and not stop.is_set():
+                    try:
+                        result = fetch_fn(driver, item)
+                    except Exception as e:
+                        logging.error(f"Error fetching detail page for {item}: {e}")
+                        results.put((item, None, e))
+                        item = work.get()
+                        break
+                    results.put((item, result, None))
+                    item = work.get()
+        except Exception as e:
+            # No session could be leased for this item
+            logging.error(f"Error leasing a WebDriver session for {item}: {e}")
+            results.put((item, None, e))
+            item = work.get()
+
+def _feed(items, work, stop, workers):
+    for item in items:
+        if stop.is_set():
+            break
+        work.put(item)
+    for _ in range(workers):
+        work.put(_DONE)
+
+def fetch_details(items, fetch_fn, workers=None, source=None):
+    """
+    Call `fetch_fn(driver, item)` for every item, spread over `workers`
+    concurrent grid sessions, and yield `(item, result, error)` tuples in
+    completion order.
+
+    Items are handed out and results handed back through bounded queues, so
+    only a few pages are ever held in memory, and a slow consumer slows the
+    workers down instead of piling up results. An exception raised for one
+    item is reported in its tuple without affecting the others. Sessions
+    come from the pool for `source`'s browser profile.
+
+    In distributed mode the items are handed to worker processes through
+    the work queue instead, as long as they are URLs and `fetch_fn` is a
+    module-level function the workers can import.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    if get_distributed_crawl() and source:
+        if task_name(fetch_fn) and all(isinstance(item, str) for item in items):
+            yield from fetch_queued(items, fetch_fn, source)
+            return
+        logging.warning(f"Fetching {source} detail pages locally, they cannot be queued for workers.")
+
+    pool = get_driver_pool(source)
+    workers = max(1, min(workers or get_selenium_detail_workers(), pool.size, len(items)))
+    work = queue.Queue(maxsize=workers * 2)
+    results = queue.Queue(maxsize=workers * 2)
+    stop = threading.Event()
+    logging.info(f"Fetching {len(items)} detail pages with {workers} sessions.")
+
+    threads = [threading.Thread(target=_feed, args=(items, work, stop, workers), daemon=True)]
+    threads += [
+        threading.Thread(target=bind_token(_worker), args=(pool, work, results, stop, fetch_fn), daemon=True)
+        for _ in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        for _ in range(len(items)):
+            yield results.get()
+    finally:
+        # If the consumer stopped early, let the workers wind down and hand
+        # their sessions back instead of blocking on a full result queue
+        stop.set()
+        while any(thread.is_alive() for thread in threads):
+            try:
+                results.get(timeout=0.1)
+            except queue.Empty:
+                pass
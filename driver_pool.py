@@ -0,0 +1,339 @@
+# driver_pool.py
+import atexit
+import logging
+import queue
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import urlparse
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import WebDriverException
+from politeness import get_scheduler
+from resilience import ErrorPage, call_with_retry, get_breaker
+from metrics import get_metrics, LIFETIME_BUCKETS, PAGES_BUCKETS
+from cancellation import check_cancelled
+from fetch_cache import get_fetch_cache
+from utils import (
+    get_selenium_grid_url,
+    get_selenium_pool_size,
+    get_selenium_max_pages_per_session,
+    get_selenium_page_load_timeout,
+    get_browser_headless,
+    get_browser_page_load_strategy,
+    get_browser_block_images,
+    get_browser_block_stylesheets,
+    get_browser_block_fonts,
+    get_browser_blocked_urls
+)
+
+# Chrome DevTools endpoint, for Remote drivers that lack execute_cdp_cmd
+CDP_COMMAND = ('POST', '/session/$sessionId/goog/cdp/execute')
+
+# Status of the loaded document, from its Navigation Timing entry (Chrome 109+)
+NAVIGATION_STATUS_SCRIPT = "const entry = performance.getEntriesByType('navigation')[0]; return entry ? entry.responseStatus : null;"
+
+# Titles of the stock error pages of web servers and proxies, e.g. '503 Service Unavailable'
+ERROR_TITLE = re.compile(
+    r'\s*(?:error\s+)?([45]\d\d)\W*(?:%s)\b' % '|'.join(re.escape(status.phrase) for status in HTTPStatus if status >= 400),
+    re.IGNORECASE
+)
+
+STYLESHEET_PATTERNS = ('*.css', '*.css?*')
+FONT_PATTERNS = ('*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot', '*fonts.googleapis.com*', '*fonts.gstatic.com*')
+
+BrowserProfile = namedtuple('BrowserProfile', ['headless', 'page_load_strategy', 'block_images', 'blocked_urls'])
+
+def get_browser_profile(source=None):
+    """
+    Return the browser settings configured for `source`. Sources with equal
+    profiles share a driver pool.
+    """
+    blocked_urls = []
+    if get_browser_block_stylesheets(source):
+        blocked_urls += STYLESHEET_PATTERNS
+    if get_browser_block_fonts(source):
+        blocked_urls += FONT_PATTERNS
+    blocked_urls += get_browser_blocked_urls(source)
+    return BrowserProfile(
+        headless=get_browser_headless(source),
+        page_load_strategy=get_browser_page_load_strategy(source),
+        block_images=get_browser_block_images(source),
+        blocked_urls=tuple(blocked_urls)
+    )
+
+def _execute_cdp(driver, command, params):
+    if hasattr(driver, 'execute_cdp_cmd'):
+        return driver.execute_cdp_cmd(command, params)
+    driver.command_executor._commands.setdefault('executeCdpCommand', CDP_COMMAND)
+    return driver.execute('executeCdpCommand', {'cmd': command, 'params': params})['value']
+
+def create_driver(profile=None):
+    profile = profile or get_browser_profile()
+    options = Options()
+    if profile.headless:
+        options.add_argument("--headless=new")
+    options.page_load_strategy = profile.page_load_strategy
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    if profile.block_images:
+        options.add_argument("--blink-settings=imagesEnabled=false")
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+
+    driver = webdriver.Remote(
+        command_executor=get_selenium_grid_url(),
+        options=options,
+        keep_alive=True
+    )
+    driver.set_page_load_timeout(get_selenium_page_load_timeout())
+
+    if profile.blocked_urls:
+        try:
+            _execute_cdp(driver, 'Network.enable', {})
+            _execute_cdp(driver, 'Network.setBlockedURLs', {'urls': list(profile.blocked_urls)})
+        except Exception as e:
+            # Pages still load, just with their stylesheets, fonts and trackers
+            logging.warning(f"Could not block URLs on WebDriver session {driver.session_id}: {e}")
+    return driver
+
+class DriverPool:
+    """
+    A pool of warm WebDriver sessions on the Selenium grid.
+
+    Sessions are leased out one caller at a time and returned afterwards.
+    A returned session is quit instead of reused once it has loaded
+    `max_pages` pages or if a page load on it failed; an idle session that
+    no longer answers is replaced on the next lease.
+    """
+
+    def __init__(self, size=None, max_pages=None, factory=None):
+        self.size = size or get_selenium_pool_size()
+        self.max_pages = max_pages or get_selenium_max_pages_per_session()
+        self.factory = factory or create_driver
+        self._idle = queue.LifoQueue()  # Reuse the most recently used session first
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._lock = threading.Lock()
+        self._pages = {}
+        self._errors = {}
+        self._created = {}
+
+    def _create(self):
+        # Stop asking a dead grid for sessions once its breaker has tripped
+        driver = call_with_retry(self.factory, breaker=get_breaker('selenium-grid'))
+        with self._lock:
+            self._pages[id(driver)] = 0
+            self._errors[id(driver)] = 0
+            self._created[id(driver)] = time.monotonic()
+        get_metrics().inc('webdriver_sessions_created_total')
+        logging.info(f"Created WebDriver session {driver.session_id}.")
+        return driver
+
+    def _discard(self, driver):
+        with self._lock:
+            pages = self._pages.pop(id(driver), None)
+            self._errors.pop(id(driver), None)
+            created = self._created.pop(id(driver), None)
+        if created is not None:
+            metrics = get_metrics()
+            metrics.observe('webdriver_session_lifetime_seconds', time.monotonic() - created, buckets=LIFETIME_BUCKETS)
+            metrics.observe('webdriver_session_pages', pages, buckets=PAGES_BUCKETS)
+        try:
+            driver.quit()
+        except Exception as e:
+            logging.warning(f"Error quitting WebDriver session: {e}")
+
+    def _is_healthy(self, driver):
+        try:
+            driver.current_url  # Cheap round-trip that fails on a dead session
+            return True
+        except WebDriverException:
+            return False
+
+    def acquire(self):
+        # Sources share the pool, so keep an eye on cancellation while waiting
+        while not self._slots.acquire(timeout=1):
+            check_cancelled()
+        try:
+            while True:
+                try:
+                    driver = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._create()
+                if self._is_healthy(driver):
+                    return driver
+                logging.warning("Discarding unresponsive WebDriver session.")
+                self._discard(driver)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, driver, failed=False):
+        with self._lock:
+            pages = self._pages.get(id(driver), 0)
+            failed = failed or self._errors.get(id(driver), 0) > 0
+        if failed or pages >= self.max_pages:
+            logging.info(f"Recycling WebDriver session after {pages} pages (failed={failed}).")
+            self._discard(driver)
+        else:
+            self._idle.put(driver)
+        self._slots.release()
+
+    @contextmanager
+    def lease(self, implicit_wait=0):
+        """
+        Borrow a session for the duration of a `with` block.
+        """
+        driver = self.acquire()
+        failed = False
+        try:
+            driver.implicitly_wait(implicit_wait)
+            yield driver
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self.release(driver, failed)
+
+    def record_page(self, driver, ok=True):
+        with self._lock:
+            if id(driver) in self._pages:
+                self._pages[id(driver)] += 1
+                if not ok:
+                    self._errors[id(driver)] += 1
+
+    def keep_warm(self):
+        """
+        Touch every idle session, so the grid does not time it out between
+        runs, and discard the ones that no longer answer. Sessions in use
+        are left alone.
+        """
+        checked = []
+        while self._slots.acquire(blocking=False):
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                self._slots.release()
+                break
+            if self._is_healthy(driver):
+                checked.append(driver)
+            else:
+                logging.warning("Discarding unresponsive idle WebDriver session.")
+                self._discard(driver)
+            self._slots.release()
+        for driver in reversed(checked):
+            self._idle.put(driver)  # Keep the most recently used session on top
+        return len(checked)
+
+    def close(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(driver)
+
+_pools = {}
+_pool_lock = threading.Lock()
+
+def get_driver_pool(source=None):
+    """
+    Return the process-wide driver pool for `source`'s browser profile,
+    creating it on first use.
+    """
+    profile = get_browser_profile(source)
+    with _pool_lock:
+        if profile not in _pools:
+            pool = _pools[profile] = DriverPool(factory=partial(create_driver, profile))
+            atexit.register(pool.close)
+        return _pools[profile]
+
+def get_driver_pools():
+    with _pool_lock:
+        return list(_pools.values())
+
+def close_driver_pools():
+    """
+    Quit the idle sessions of every pool, recording their lifetimes and
+    page counts. The pools stay usable and create new sessions on demand.
+    """
+    for pool in get_driver_pools():
+        pool.close()
+
+def _record_page(driver, ok=True):
+    # Only the pool that created the session knows it
+    for pool in get_driver_pools():
+        pool.record_page(driver, ok)
+
+def page_status(driver):
+    """
+    Return the HTTP status of the page loaded in `driver`, or None if the
+    browser does not report it and the title is not a server error page's.
+    """
+    try:
+        status = driver.execute_script(NAVIGATION_STATUS_SCRIPT)
+    except WebDriverException:
+        status = None
+    if status:  # 0 where the browser does not expose it
+        return int(status)
+    match = ERROR_TITLE.match(driver.title or '')
+    return int(match.group(1)) if match else None
+
+def load_page(driver, url):
+    """
+    Navigate `driver` to `url` once the politeness scheduler allows it,
+    counting the page against its session. Transient failures are retried
+    with backoff behind the host's circuit breaker, and Cancelled is raised
+    instead of loading once the calling source has been cancelled.
+
+    A page rendered from an error response raises ErrorPage, so it is
+    retried, or fails the fetch, just like the same status over HTTP.
+    """
+    scheduler = get_scheduler()
+    metrics = get_metrics()
+    host = urlparse(url).netloc
+
+    def attempt():
+        check_cancelled()
+        scheduler.acquire(url)
+        start = time.monotonic()
+        try:
+            driver.get(url)
+        except Exception:
+            # A browser cannot see status codes, so failed loads count as throttling
+            scheduler.report(url, error=True)
+            _record_page(driver, ok=False)
+            raise
+        latency = time.monotonic() - start
+        status = page_status(driver)
+        scheduler.report(url, latency=latency, status=status)
+        metrics.observe('fetch_seconds', latency, host=host, transport='browser')
+        if status is not None:
+            metrics.inc('http_responses_total', host=host, status=status)
+        _record_page(driver)
+        if status is not None and status >= 400:
+            raise ErrorPage(url, status)
+
+    call_with_retry(attempt, breaker=get_breaker(host))
+
+def fetch_page_source(driver, url, wait_for=(By.TAG_NAME, 'body'), timeout=10):
+    """
+    Load `url` in `driver` and return its HTML once the `wait_for` locator
+    is present. A page already loaded in a browser this run under the same
+    canonical URL is served from the fetch cache instead of being loaded
+    again.
+    """
+    def fetch():
+        load_page(driver, url)
+        WebDriverWait(driver, timeout).until(EC.presence_of_element_located(wait_for))
+        html = driver.page_source
+        get_metrics().record_bytes(url, len(html), 'browser')
+        return html
+
+    return get_fetch_cache().get(url, fetch, 'browser')
@@ -0,0 +1,84 @@
+# fetch_cache.py
+import threading
+from collections import OrderedDict
+from metrics import get_metrics
+from urls import canonical_url
+from utils import get_fetch_cache_max_mb
+
+class FetchCache:
+    """
+    In-run cache of fetched pages keyed by transport and canonical URL, so
+    a detail page listed under several categories or sources is downloaded
+    once. Pages fetched over HTTP and rendered by the browser are kept
+    apart, since a browser fallback exists because the HTTP copy fell short.
+
+    The first caller for a URL fetches it; callers asking for the same URL
+    meanwhile wait for that fetch and share its result. Failed fetches are
+    not cached. The least recently used pages are dropped once the cache
+    holds more than `max_mb` megabytes of page text.
+    """
+
+    def __init__(self, max_mb=None):
+        self.max_chars = (get_fetch_cache_max_mb() if max_mb is None else max_mb) * 1024 * 1024
+        self._pages = OrderedDict()
+        self._pending = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, fetch, transport='http'):
+        """
+        Return the page at `url`, calling `fetch()` for it only if no other
+        caller has fetched it over the same `transport` this run.
+        """
+        if not self.max_chars:
+            return fetch()
+        key = (transport, canonical_url(url))
+
+        while True:
+            with self._lock:
+                if key in self._pages:
+                    self._pages.move_to_end(key)
+                    get_metrics().inc('fetch_cache_hits_total')
+                    return self._pages[key]
+                pending = self._pending.get(key)
+                if pending is None:
+                    pending = self._pending[key] = threading.Event()
+                    break
+            # Another caller is fetching the page; use its result, or try
+            # again ourselves if that fetch failed
+            pending.wait()
+
+        try:
+            page = fetch()
+            if page:
+                self._store(key, page)
+            return page
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+
+    def _store(self, key, page):
+        with self._lock:
+            self._pages[key] = page
+            self._size += len(page)
+            while self._size > self.max_chars and self._pages:
+                _, evicted = self._pages.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._size = 0
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_fetch_cache():
+    """
+    Return the process-wide fetch cache, creating it on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FetchCache()
+        return _cache
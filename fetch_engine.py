@@ -0,0 +1,100 @@
+# fetch_engine.py
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils import get_simple_max_workers, get_simple_per_host_limit
+from cancellation import bind_token
+
+def create_session(pool_size):
+    """
+    Create a requests session whose connection pool can keep `pool_size`
+    keep-alive connections open per host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+class FetchEngine:
+    """
+    Fetch many URLs concurrently over a shared, pooled session.
+
+    `max_workers` bounds the number of requests in flight overall and
+    `per_host_limit` bounds the number in flight against a single host, so
+    a run takes about as long as the slowest host instead of the sum of all
+    hosts. The request rate towards each host is left to the politeness
+    scheduler, which `fetch_fn` is expected to go through.
+    """
+
+    def __init__(self, max_workers=None, per_host_limit=None, session=None):
+        self.max_workers = max_workers or get_simple_max_workers()
+        self.per_host_limit = per_host_limit or get_simple_per_host_limit()
+        self.session = session or create_session(self.max_workers)
+
+    def close(self):
+        self.session.close()
+
+    def _build_lanes(self, urls):
+        # Group the URLs by host and deal each host's URLs round-robin over at
+        # most `per_host_limit` lanes. A lane is processed sequentially, so the
+        # number of lanes per host is the per-host concurrency.
+        by_host = OrderedDict()
+        for url in urls:
+            by_host.setdefault(urlparse(url).netloc, []).append(url)
+
+        lanes = []
+        for host_urls in by_host.values():
+            lane_count = min(self.per_host_limit, len(host_urls))
+            for i in range(lane_count):
+                lanes.append(host_urls[i::lane_count])
+        return lanes
+
+    def _run_lane(self, lane, fetch_fn, results, stop):
+        for url in lane:
+            if stop.is_set():
+                return
+            try:
+                result = fetch_fn(url, self.session)
+            except Exception as e:
+                logging.error(f"Unhandled error fetching {url}: {e}")
+                result = None
+            results.put((url, result))
+
+    def fetch_all(self, urls, fetch_fn):
+        """
+        Call `fetch_fn(url, session)` for every URL and yield `(url, result)`
+        pairs in completion order, so callers can process results while the
+        remaining fetches are still running. Results are handed over through
+        a bounded queue, so lanes wait for a slow consumer.
+        """
+        urls = list(urls)
+        if not urls:
+            return
+
+        lanes = self._build_lanes(urls)
+        workers = min(self.max_workers, len(lanes))
+        results = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+        logging.info(f"Fetching {len(urls)} URLs over {len(lanes)} lanes with {workers} workers.")
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(bind_token(self._run_lane), lane, fetch_fn, results, stop) for lane in lanes]
+            try:
+                for _ in range(len(urls)):
+                    yield results.get()
+            finally:
+                # Unblock the lanes if the consumer stopped early
+                stop.set()
+                while not all(future.done() for future in futures):
+                    try:
+                        results.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
@@ -1,126 +1,294 @@
 # fma_scraper.py
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import pandas as pd
 import os
 import logging
-from bs4 import BeautifulSoup
+from itertools import groupby
+from operator import itemgetter
+from manifest import record_file, replacing
+from driver_pool import get_driver_pool, load_page, fetch_page_source
+from detail_fetcher import fetch_details
+from http_scraper import JavaScriptRequired, fetch_soup, fetch_pages, page_soup
+from utils import get_scrape_mode, get_fma_url, get_fma_categories
+from crawl_state import get_crawl_state
+from snapshot_store import use_columnar_storage, save_records
+from blob_store import content_fields
+from resilience import CircuitOpenError
+from cancellation import Cancelled
+from metrics import get_metrics
+from parsing import find_title
+from urls import canonical_url, resolve_url
+from categories import ALL, IncompleteListing, parse_selection, parse_options, crawl_categories
 
-# Setup logging
-logging.basicConfig(filename='fma_scraper.log', level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# Source name used for crawl state and run metrics
+SOURCE = 'fma'
 
-# Define the specific categories to scrape
+# The categories scraped unless FMA_CATEGORIES says otherwise
 SPECIFIC_CATEGORIES = [
     'Banks - Banks licensed in Austria',
     'Payment institutions - Account information service provider (AISP)',
     'Payment institutions - Payment initiation service provider (PISP)'
 ]
 
-def scrape_fma_site(base_url):
-    options = Options()
-    options.headless = True  # Run Chrome in headless mode
-    options.add_argument("--no-sandbox")  # Bypass OS security model
-    options.add_argument("--disable-dev-shm-usage")  # Overcome limited resource problems
+def scrape_fma_site(base_url, categories=None):
+    """
+    Yield the listed entries category by category, so the detail pages of
+    one category can be fetched and saved before the next one is listed.
+    `categories` are names or numbers, or ALL, and default to
+    SPECIFIC_CATEGORIES.
+    """
+    listed = 0
+    for category_number, category_name in discover_categories(base_url, categories):
+        for entry in scrape_fma_category(base_url, category_number, category_name):
+            listed += 1
+            yield entry
+    logging.info(f"Successfully scraped {listed} links from FMA site.")
 
-    driver = webdriver.Remote(
-        command_executor='http://localhost:4444/wd/hub',
-        options=options
-    )
+def discover_categories(base_url, categories=None):
+    """
+    Return `(number, name)` for the selected categories of the #category
+    select.
+    """
+    if get_scrape_mode('FMA') == 'http':
+        try:
+            soup, _ = fetch_soup(base_url, required='#category')
+            return parse_categories(soup, categories)
+        except JavaScriptRequired as e:
+            logging.warning(f"Falling back to Selenium for FMA: {e}")
 
-    all_data = []
+    with get_driver_pool(SOURCE).lease() as driver:
+        return list_categories(driver, base_url, categories)
 
-    try:
-        driver.get(base_url)
-
-        # Extract category numbers and names from the <select> element
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'category')))
-        select_element = driver.find_element(By.ID, 'category')
-        options = select_element.find_elements(By.TAG_NAME, 'option')
-
-        categories = [(option.get_attribute('value'), option.text) for option in options if option.get_attribute('value') and option.text in SPECIFIC_CATEGORIES]
-
-        for category_number, category_name in categories:
-            if category_number:  # Skip empty values
-                page_number = 1
-                while True:
-                    category_url = f"{base_url}?cname=&place=&bic=&category={category_number}&per_page=10&submitted=1&to={page_number}"
-                    logging.info(f"Processing category URL: {category_url}")
-                    driver.get(category_url)
-
-                    try:
-                        # Wait for links to load
-                        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, '.print-view-button-wrap a')))
-                        links = driver.find_elements(By.CSS_SELECTOR, '.print-view-button-wrap a')
-
-                        for link in links:
-                            href = link.get_attribute('href').replace('amp;', '')
-                            corrected_url = href.replace('https://', '').replace('/', '-')
-                            all_data.append({'category': category_name, 'link': href, 'corrected_url': corrected_url})
-
-                        # Check for next page
-                        next_button = driver.find_element(By.CSS_SELECTOR, 'li.copy.next a')
-                        if 'disabled' in next_button.get_attribute('class'):
-                            break
-                        page_number += 1
-
-                    except Exception as link_error:
-                        logging.error(f"Error processing links for category {category_name}: {link_error}")
-                        break
-
-        logging.info(f"Successfully scraped {len(all_data)} links from FMA site.")
-    except Exception as e:
-        logging.error(f"Error during scraping: {e}")
-    finally:
-        driver.quit()
+def scrape_fma_category(base_url, category_number, category_name):
+    """
+    Yield the entries listed in one category.
+    """
+    if get_scrape_mode('FMA') == 'http':
+        entries = list_category_entries_http(base_url, category_number, category_name)
+    else:
+        # Hand the session back before yielding, the detail fetch needs it
+        with get_driver_pool(SOURCE).lease() as driver:
+            entries = list_category_entries(driver, base_url, category_number, category_name)
+    # An institution linked twice in the listing is kept once
+    entries = list({canonical_url(entry['link']): entry for entry in entries}.values())
+    logging.info(f"Listed {len(entries)} entries in FMA category {category_name}.")
+    yield from entries
+
+def list_categories(driver, base_url, categories=None):
+    load_page(driver, base_url)
+
+    # Extract category numbers and names from the <select> element
+    WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.ID, 'category')))
+    soup, _ = page_soup(driver)
+    return parse_categories(soup, categories)
+
+def list_category_entries(driver, base_url, category_number, category_name):
+    entries = []
+    metrics = get_metrics()
+    page_number = 1
+    while True:
+        category_url = f"{base_url}?cname=&place=&bic=&category={category_number}&per_page=10&submitted=1&to={page_number}"
+        logging.info(f"Processing category URL: {category_url}")
+
+        try:
+            with metrics.span('pagination', SOURCE):
+                load_page(driver, category_url)
+
+                # Wait for links to load
+                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, '.print-view-button-wrap a')))
+                soup, page_url = page_soup(driver)
+
+            # Extract the links and the next-page marker from one snapshot of the page
+            with metrics.span('link_extraction', SOURCE):
+                page_entries, has_next = parse_listing_page(soup, page_url, category_name)
+            entries.extend(page_entries)
+
+            if not has_next:
+                break
+            page_number += 1
+
+        except (CircuitOpenError, Cancelled):
+            raise  # The host is down or the run is cancelled, give up on the remaining categories too
+        except Exception as link_error:
+            logging.error(f"Error processing links for category {category_name}: {link_error}")
+            raise  # A cut-short listing would report the rest of the category as removed
+
+    return entries
+
+def parse_categories(soup, categories=None):
+    options = parse_options(soup, '#category')
+    if categories == ALL:
+        return options
+    wanted = set(categories or SPECIFIC_CATEGORIES)
+    return [(value, label) for value, label in options if label in wanted or value in wanted]
+
+def parse_listing_page(soup, page_url, category_name):
+    """
+    Return the entries listed on a category page and whether there is a
+    next page.
+    """
+    entries = []
+    for link in soup.select('.print-view-button-wrap a'):
+        href = resolve_url(link.get('href', ''), page_url)
+        corrected_url = href.replace('https://', '').replace('/', '-')
+        entries.append({'category': category_name, 'link': href, 'corrected_url': corrected_url})
+
+    next_button = soup.select_one('li.copy.next a')
+    has_next = next_button is not None and 'disabled' not in (next_button.get('class') or [])
+    return entries, has_next
+
+def list_category_entries_http(base_url, category_number, category_name):
+    """
+    Same as list_category_entries, but fetches the server-rendered listing
+    pages over plain HTTP instead of through the Selenium grid.
+    """
+    entries = []
+    page_number = 1
+    while True:
+        category_url = f"{base_url}?cname=&place=&bic=&category={category_number}&per_page=10&submitted=1&to={page_number}"
+        logging.info(f"Processing category URL over HTTP: {category_url}")
 
-    return all_data
+        try:
+            with get_metrics().span('pagination', SOURCE):
+                soup, page_url = fetch_soup(category_url)
+            page_entries, has_next = parse_listing_page(soup, page_url, category_name)
+            if not page_entries:
+                if page_number > 1:
+                    raise IncompleteListing(f"No links found for category {category_name} on page {page_number}")
+                logging.warning(f"No links found for category {category_name}")
+                break
+            entries.extend(page_entries)
 
-def scrape_page_content(url):
-    options = Options()
-    options.headless = True
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
+            # Check for next page
+            if not has_next:
+                break
+            page_number += 1
 
-    driver = webdriver.Remote(
-        command_executor='http://localhost:4444/wd/hub',
-        options=options
-    )
+        except (CircuitOpenError, Cancelled):
+            raise
+        except Exception as link_error:
+            logging.error(f"Error processing links for category {category_name}: {link_error}")
+            raise  # A cut-short listing would report the rest of the category as removed
+
+    return entries
+
+def scrape_page_content(url, driver=None):
+    # Borrow a warm session instead of starting a new browser per page
+    if driver is None:
+        with get_driver_pool(SOURCE).lease() as driver:
+            return scrape_page_content(url, driver)
 
     page_content = ""
 
     try:
-        driver.get(url)
-        # Wait for the page content to load
-        WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.TAG_NAME, 'html')))
-        page_content = driver.page_source
+        with get_metrics().span('detail_fetch', SOURCE):
+            page_content = fetch_page_source(driver, url, (By.TAG_NAME, 'html'))
+    except (CircuitOpenError, Cancelled):
+        raise
     except Exception as e:
         logging.error(f"Error scraping page content from {url}: {e}")
-    finally:
-        driver.quit()
 
     return page_content
 
-def save_data(data, base_path):
+def fetch_entry_pages(data):
+    """
+    Yield `(entry, page_content)` for every entry, fetched over HTTP or spread
+    over several grid sessions depending on the FMA scrape mode.
+    """
+    entries_by_link = {}
+    for entry in data:
+        entries_by_link.setdefault(entry['link'], []).append(entry)
+
+    if get_scrape_mode('FMA') == 'http':
+        for link, page_content in fetch_pages(entries_by_link, SOURCE):
+            # A detail page without a server-rendered <title> needs the browser
+            if page_content and find_title(page_content) is None:
+                logging.warning(f"Falling back to Selenium for {link}")
+                page_content = scrape_page_content(link)
+            for entry in entries_by_link[link]:
+                yield entry, page_content
+        return
+
+    for link, page_content, error in fetch_details(list(entries_by_link), fetch_page, source=SOURCE):
+        if not error:
+            for entry in entries_by_link[link]:
+                yield entry, page_content
+
+def fetch_page(driver, url):
+    # The unit of work handed to detail workers, local or distributed
+    return scrape_page_content(url, driver)
+
+def select_entries_to_fetch(data):
+    """
+    Keep only the entries the crawl state wants fetched this run.
+    """
+    entries_by_category = {}
     for entry in data:
-        category_dir = os.path.join(base_path, 'fma', entry['category'])
-        if not os.path.exists(category_dir):
-            os.makedirs(category_dir)
+        entries_by_category.setdefault(entry['category'], []).append(entry)
+
+    selected = []
+    for category, entries in entries_by_category.items():
+        links_to_fetch = set(get_crawl_state().plan(SOURCE, category, [entry['link'] for entry in entries]))
+        selected.extend(entry for entry in entries if entry['link'] in links_to_fetch)
+    return selected
+
+def save_data(data, base_path):
+    """
+    Fetch, extract and save the entries of `data`, which may be a generator
+    yielding them category by category. Records are written as their detail
+    pages arrive, while the remaining pages are still being fetched.
+    """
+    for category, entries in groupby(data, key=itemgetter('category')):
+        records = extract_records(fetch_entry_pages(select_entries_to_fetch(list(entries))))
+        if use_columnar_storage():
+            save_records(base_path, 'fma', records, SOURCE)
+        else:
+            save_files(records, base_path)
 
-        # Scrape the content from each corrected URL
-        page_content = scrape_page_content(entry['link'])
+def run(context, url=None, category=None):
+    # Categories are crawled side by side, their entries streaming from the
+    # listing into the detail fetch and on to disk
+    fma_url = url or get_fma_url()
+    print(f"Scraping FMA URL: {fma_url}")
+    categories = discover_categories(fma_url, parse_selection(category or get_fma_categories()))
+    crawl_categories(SOURCE, categories, lambda number, name: save_data(scrape_fma_category(fma_url, number, name), context.base_path))
+    print(f"Finished scraping FMA URL: {fma_url}")
+
+def extract_records(pages):
+    metrics = get_metrics()
+    for entry, page_content in pages:
+        if not page_content:
+            continue
 
         # Extract title content for filename
-        title = extract_title(page_content)
-        file_path = os.path.join(category_dir, f"{title}.csv")
+        with metrics.span('parse', SOURCE):
+            title = extract_title(page_content)
+        if not title:
+            logging.error(f"No title found on {entry['link']}, skipping it.")
+            continue
+        yield {'category': entry['category'], 'link': entry['link'], 'title': title, 'content': page_content}
+
+def save_files(records, base_path):
+    metrics = get_metrics()
+    for record in records:
+        with metrics.span('save', SOURCE):
+            category_dir = os.path.join(base_path, 'fma', record['category'])
+            if not os.path.exists(category_dir):
+                os.makedirs(category_dir)
+
+            file_path = os.path.join(category_dir, f"{record['title']}.csv")
 
-        df = pd.DataFrame([{'category': entry['category'], 'link': entry['link'], 'content': page_content}])
-        df.to_csv(file_path, index=False)
+            df = pd.DataFrame([{'category': record['category'], 'link': record['link'], **content_fields(record['content'])}])
+            with replacing(file_path) as tmp_path:
+                df.to_csv(tmp_path, index=False)
+            get_crawl_state().record_fetch(SOURCE, record['category'], record['link'], record['content'], record['title'], record_file(file_path))
         logging.info(f"Saved data to {file_path}")
 
 def extract_title(page_content):
-    soup = BeautifulSoup(page_content, 'html.parser')
-    title = soup.title.string.strip().replace('/', '-').replace('\\', '-').replace(':', '-')
-    return title
+    # Stops parsing at </title> instead of building the whole page
+    title = find_title(page_content)
+    if title is None:
+        return None
+    return title.strip().replace('/', '-').replace('\\', '-').replace(':', '-')
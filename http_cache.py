@@ -0,0 +1,101 @@
+# http_cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from utils import get_http_cache_path
+
+def body_digest(body):
+    """
+    Return the SHA-256 hex digest of a response body.
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    return hashlib.sha256(body).hexdigest()
+
+class ValidatorCache:
+    """
+    Persistent per-URL cache of HTTP validators (ETag, Last-Modified) and the
+    digest of the last body we processed, used to make conditional requests.
+
+    New validators are only staged while a run is in progress and take
+    effect with `commit`, once the snapshot holding those bodies has been
+    promoted; otherwise a run that dies before promotion would leave the
+    cache claiming a change it never recorded.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or get_http_cache_path()
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self._staged = {}
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable HTTP cache {self.path}: {e}")
+            return {}
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._staged = {}
+
+    def conditional_headers(self, url):
+        """
+        Return the If-None-Match / If-Modified-Since headers for `url`.
+        """
+        with self._lock:
+            entry = self._entries.get(url)
+        headers = {}
+        if entry:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def is_unchanged(self, url, digest):
+        with self._lock:
+            entry = self._entries.get(url)
+        return bool(entry) and entry.get('digest') == digest
+
+    def stage(self, url, response, digest):
+        with self._lock:
+            self._staged[url] = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'digest': digest
+            }
+
+    def unstage(self, url):
+        with self._lock:
+            self._staged.pop(url, None)
+
+    def commit(self):
+        """
+        Apply the staged validators and save the cache.
+        """
+        with self._lock:
+            self._entries.update(self._staged)
+            self._staged = {}
+        self.save()
+
+    def save(self):
+        """
+        Write the cache to disk, replacing the previous file atomically.
+        """
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
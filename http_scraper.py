@@ -0,0 +1,115 @@
+# http_scraper.py
+import logging
+import threading
+from functools import partial
+from bs4 import BeautifulSoup
+from fetch_engine import FetchEngine, create_session
+from politeness import polite_request
+from metrics import get_metrics
+from parsing import HTML_PARSER
+from fetch_cache import get_fetch_cache
+from utils import (
+    get_http_timeout,
+    get_http_pool_size,
+    get_http_per_host_limit
+)
+
+class JavaScriptRequired(Exception):
+    """
+    Raised when a page fetched over plain HTTP lacks the server-rendered
+    markup we need, meaning it can only be scraped with a browser.
+    """
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_http_session():
+    """
+    Return the process-wide pooled session used by the HTTP scraping mode.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session(get_http_pool_size())
+        return _session
+
+def fetch_html(url, session=None, method='GET', data=None):
+    """
+    Fetch a page and return its decoded HTML and final URL.
+    """
+    session = session or get_http_session()
+    if method == 'GET':
+        response = polite_request(session, 'GET', url, params=data, timeout=get_http_timeout())
+    else:
+        response = polite_request(session, method, url, data=data, timeout=get_http_timeout())
+    response.raise_for_status()
+    return response.text, response.url
+
+def fetch_soup(url, required=None, method='GET', data=None, session=None):
+    """
+    Fetch and parse a page, returning the soup and the final URL.
+
+    If the CSS selector `required` matches nothing the page is assumed to be
+    rendered client-side and JavaScriptRequired is raised.
+    """
+    html, final_url = fetch_html(url, session, method=method, data=data)
+    soup = BeautifulSoup(html, HTML_PARSER)
+    if required and soup.select_one(required) is None:
+        raise JavaScriptRequired(f"{url} has no element matching {required!r}")
+    return soup, final_url
+
+def page_soup(driver):
+    """
+    Parse the browser's current page locally, returning the soup and the
+    page URL. Two round-trips to the grid replace one per element lookup.
+    """
+    return BeautifulSoup(driver.page_source, HTML_PARSER), driver.current_url
+
+def form_fields(form, overrides, submit_id=None):
+    """
+    Collect the fields a browser would submit for `form`, including the
+    submit button with id `submit_id`, then apply `overrides`.
+    """
+    data = {}
+    for field in form.find_all(['input', 'select', 'textarea', 'button']):
+        name = field.get('name')
+        if not name:
+            continue
+        if field.name in ('input', 'button'):
+            field_type = (field.get('type') or ('submit' if field.name == 'button' else 'text')).lower()
+            if field_type in ('submit', 'button', 'image', 'reset'):
+                if submit_id and field.get('id') == submit_id:
+                    data[name] = field.get('value', '')
+                continue
+            if field_type in ('checkbox', 'radio') and not field.has_attr('checked'):
+                continue
+            data[name] = field.get('value', '')
+        elif field.name == 'select':
+            option = field.find('option', selected=True) or field.find('option')
+            data[name] = option.get('value', option.get_text()) if option else ''
+        else:
+            data[name] = field.get_text()
+    data.update(overrides)
+    return data
+
+def _fetch_text(url, session, source=None):
+    try:
+        with get_metrics().span('detail_fetch', source):
+            # A page already fetched this run, under any category or source, is reused
+            html = get_fetch_cache().get(url, lambda: fetch_html(url, session)[0])
+        return html
+    except Exception as e:
+        logging.error(f"Error fetching {url} over HTTP: {e}")
+        return None
+
+def fetch_pages(urls, source=None):
+    """
+    Fetch many pages concurrently over the shared session and yield
+    `(url, html)` pairs as they complete; `html` is None on failure.
+    Fetch times are recorded under `source` in the run metrics.
+    """
+    engine = FetchEngine(
+        per_host_limit=get_http_per_host_limit(),
+        session=get_http_session()
+    )
+    yield from engine.fetch_all(urls, partial(_fetch_text, source=source))
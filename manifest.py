@@ -0,0 +1,204 @@
+# manifest.py
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from cancellation import check_cancelled
+
+MANIFEST_NAME = 'manifest.json'
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """
+    Return the SHA-256 hex digest of a file's content.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+class Manifest:
+    """
+    Digest, size and mtime of every output file in a snapshot directory,
+    keyed by the file's path relative to the snapshot root.
+    """
+
+    def __init__(self, root, entries=None):
+        self.root = root
+        self.entries = entries or {}
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.root, MANIFEST_NAME)
+
+    def relative_path(self, file_path):
+        return os.path.relpath(file_path, self.root).replace(os.sep, '/')
+
+    def record(self, file_path):
+        stat = os.stat(file_path)
+        entry = {'digest': file_digest(file_path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+        relative_path = self.relative_path(file_path)
+        with self._lock:
+            self.entries[relative_path] = entry
+        return relative_path
+
+    def save(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with self._lock:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+class SnapshotClosed(Exception):
+    """
+    Raised instead of saving a file into a snapshot that has been closed,
+    e.g. by a source that was abandoned and kept running after its run.
+    """
+
+@contextmanager
+def replacing(file_path):
+    """
+    Yield a temporary path to write `file_path` through, and move it into
+    place once written. Carried-over files are hard links shared with the
+    previous generation, so output files are always replaced, never
+    rewritten in place.
+
+    Raises Cancelled once the calling source has been cancelled, and
+    SnapshotClosed if the snapshot holding `file_path` has been closed,
+    instead of moving the file into place.
+    """
+    check_cancelled()
+    tmp_path = f"{file_path}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        # Checked under the lock close_snapshot takes, so nothing lands
+        # in a snapshot once it is closed
+        with _open_lock:
+            check_cancelled()
+            _check_open(os.path.abspath(file_path))
+            os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def build_manifest(root):
+    """
+    Build a manifest by hashing every file under `root`. Only needed for
+    snapshot directories written before manifests existed.
+    """
+    manifest = Manifest(root)
+    for dirpath, _, files in os.walk(root):
+        for file in files:
+            if dirpath == root and file == MANIFEST_NAME:
+                continue
+            manifest.record(os.path.join(dirpath, file))
+    return manifest
+
+def load_manifest(root):
+    """
+    Load the manifest of the snapshot at `root`, building it if it is missing.
+    """
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, encoding='utf-8') as f:
+                return Manifest(root, json.load(f))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Rebuilding unreadable manifest {manifest_path}: {e}")
+    manifest = build_manifest(root)
+    manifest.save()
+    return manifest
+
+# Manifests of the snapshots currently being written, keyed by absolute root
+_open_manifests = {}
+# Roots of the snapshots that have been closed, which must not change any more
+_closed_roots = set()
+_open_lock = threading.Lock()
+
+def _check_open(abs_path):
+    # Called with _open_lock held
+    for root in _closed_roots:
+        if abs_path.startswith(root + os.sep):
+            raise SnapshotClosed(f"Not saving {abs_path}: snapshot {root} is closed")
+
+def open_snapshot(root):
+    """
+    Start recording the files saved under `root` into its manifest.
+    """
+    manifest = load_manifest(root) if os.path.exists(root) else Manifest(root)
+    with _open_lock:
+        _open_manifests[os.path.abspath(root)] = manifest
+        _closed_roots.discard(os.path.abspath(root))
+    return manifest
+
+def close_snapshot(root):
+    """
+    Stop recording files under `root` and write its manifest to disk. From
+    then on, saving a file under `root` raises SnapshotClosed.
+    """
+    with _open_lock:
+        manifest = _open_manifests.pop(os.path.abspath(root), None)
+        _closed_roots.add(os.path.abspath(root))
+    if manifest:
+        manifest.save()
+    return manifest
+
+def record_file(file_path):
+    """
+    Record a freshly saved file in the manifest of the open snapshot that
+    contains it and return its path relative to the snapshot root. Files
+    outside any snapshot are ignored and None is returned; SnapshotClosed
+    is raised for files in a closed one.
+    """
+    abs_path = os.path.abspath(file_path)
+    with _open_lock:
+        _check_open(abs_path)
+        manifests = list(_open_manifests.items())
+    for root, manifest in manifests:
+        if abs_path.startswith(root + os.sep):
+            return manifest.record(abs_path)
+    return None
+
+def carry_over(old_manifest, new_manifest, relative_path):
+    """
+    Copy an unchanged file and its manifest entry from the old snapshot into
+    the new one without re-reading or re-hashing it. The copy is a hard link
+    where possible, so it must only ever be replaced (see `replacing`).
+    """
+    if relative_path in new_manifest.entries:
+        return True  # Never overwrite a file written during this run
+    entry = old_manifest.entries.get(relative_path)
+    source = os.path.join(old_manifest.root, relative_path)
+    if entry is None or not os.path.exists(source):
+        return False
+    target = os.path.join(new_manifest.root, relative_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    with new_manifest._lock:
+        new_manifest.entries[relative_path] = dict(entry)
+    return True
+
+def diff_manifests(old, new):
+    """
+    Compare two manifests by digest and return the added, removed and
+    modified relative paths.
+
+    A path missing from `new` only counts as removed when `new` still has
+    other files in the same directory; a directory that vanished completely
+    means its source failed to run, not that every entry was delisted.
+    """
+    new_dirs = {os.path.dirname(path) for path in new.entries}
+    added = sorted(path for path in new.entries if path not in old.entries)
+    removed = sorted(path for path in old.entries
+                     if path not in new.entries and os.path.dirname(path) in new_dirs)
+    modified = sorted(path for path, entry in new.entries.items()
+                      if path in old.entries and old.entries[path]['digest'] != entry['digest'])
+    return {'added': added, 'removed': removed, 'modified': modified}
@@ -0,0 +1,249 @@
+# metrics.py
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse
+from utils import get_metrics_report_path, get_metrics_prometheus_path
+
+# Upper bounds in seconds, chosen to cover fast HTTP fetches up to slow grid page loads
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+LIFETIME_BUCKETS = (10, 30, 60, 300, 600, 1800, 3600, 10800)
+PAGES_BUCKETS = (1, 10, 50, 100, 200, 500, 1000)
+
+def _key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+class Histogram:
+    """
+    Cumulative-bucket histogram in the Prometheus sense.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket it falls in.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class RunMetrics:
+    """
+    Counters, histograms and per-stage timings for one scraper run.
+
+    Stage spans are aggregated per (source, stage) rather than kept one by
+    one, so memory stays flat however many pages a run fetches.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.monotonic()
+        self._counters = {}
+        self._histograms = {}
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            key = (name, _key(labels))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        with self._lock:
+            key = (name, _key(labels))
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(buckets)
+            self._histograms[key].observe(value)
+
+    @contextmanager
+    def span(self, stage, source=None):
+        """
+        Time the `with` block as one occurrence of `stage`, counting it as an
+        error if it raises.
+        """
+        start = time.monotonic()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                stats = self._stages.setdefault((source or 'run', stage), {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0})
+                stats['count'] += 1
+                stats['seconds'] += elapsed
+                stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+                stats['errors'] += error
+            self.observe('stage_duration_seconds', elapsed, stage=stage, source=source or 'run')
+            if error:
+                self.inc('stage_errors_total', stage=stage, source=source or 'run')
+
+    def merge(self, other):
+        """
+        Add the counters, histograms and stage timings of `other` to these.
+        """
+        with other._lock:
+            counters = dict(other._counters)
+            histograms = {key: (histogram.buckets, list(histogram.counts), histogram.sum, histogram.count) for key, histogram in other._histograms.items()}
+            stages = {key: dict(stats) for key, stats in other._stages.items()}
+        with self._lock:
+            for key, value in counters.items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, (buckets, counts, total, count) in histograms.items():
+                histogram = self._histograms.setdefault(key, Histogram(buckets))
+                histogram.counts = [mine + theirs for mine, theirs in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+            for key, theirs in stages.items():
+                stats = self._stages.setdefault(key, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'errors': 0})
+                stats['count'] += theirs['count']
+                stats['seconds'] += theirs['seconds']
+                stats['max_seconds'] = max(stats['max_seconds'], theirs['max_seconds'])
+                stats['errors'] += theirs['errors']
+
+    def record_bytes(self, url, size, transport):
+        self.inc('bytes_fetched_total', size, host=urlparse(url).netloc, transport=transport)
+
+    def report(self):
+        """
+        Return the run report as a JSON-serialisable dict.
+        """
+        with self._lock:
+            return {
+                'started_at': self.started_at.isoformat(),
+                'finished_at': datetime.now(timezone.utc).isoformat(),
+                'duration_seconds': round(time.monotonic() - self._start, 3),
+                'stages': [
+                    {'source': source, 'stage': stage, **{name: round(value, 3) for name, value in stats.items()}}
+                    for (source, stage), stats in sorted(self._stages.items())
+                ],
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in sorted(self._counters.items())
+                ],
+                'histograms': [
+                    {
+                        'name': name,
+                        'labels': dict(labels),
+                        'count': histogram.count,
+                        'sum': round(histogram.sum, 3),
+                        'p50': histogram.quantile(0.5),
+                        'p95': histogram.quantile(0.95),
+                        'buckets': dict(zip([str(bound) for bound in histogram.buckets] + ['+Inf'], histogram.counts))
+                    }
+                    for (name, labels), histogram in sorted(self._histograms.items())
+                ]
+            }
+
+    def prometheus_text(self):
+        """
+        Render the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+            duration = time.monotonic() - self._start
+
+        lines.append('# TYPE scraper_run_duration_seconds gauge')
+        lines.append(f'scraper_run_duration_seconds {duration:.3f}')
+        lines.append('# TYPE scraper_run_finished_timestamp_seconds gauge')
+        lines.append(f'scraper_run_finished_timestamp_seconds {time.time():.0f}')
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE scraper_{name} counter')
+                typed.add(name)
+            lines.append(f'scraper_{name}{_labels(labels)} {value}')
+
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE scraper_{name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else str(bound)
+                lines.append(f'scraper_{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'scraper_{name}_sum{_labels(labels)} {histogram.sum:.6f}')
+            lines.append(f'scraper_{name}_count{_labels(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def export(self, report_path=None, prometheus_path=None):
+        """
+        Write the JSON run report and the Prometheus text file.
+        """
+        _write_atomic(report_path or get_metrics_report_path(), json.dumps(self.report(), indent=2))
+        _write_atomic(prometheus_path or get_metrics_prometheus_path(), self.prometheus_text())
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)  # Never leave a half-written file for the collector
+
+_metrics = RunMetrics()
+_finished = RunMetrics()  # Everything recorded by the runs before the current one
+_metrics_lock = threading.Lock()
+
+def get_metrics():
+    """
+    Return the metrics of the current run.
+    """
+    return _metrics
+
+def start_run():
+    """
+    Start recording a new run and return its metrics. What the previous run
+    recorded is kept for get_cumulative_metrics, so a long-running process
+    reports every run on its own.
+    """
+    global _metrics
+    with _metrics_lock:
+        _finished.merge(_metrics)
+        _metrics = RunMetrics()
+        return _metrics
+
+def get_cumulative_metrics():
+    """
+    Return the metrics of every run since the process started, the current
+    one included, for a scrape endpoint that expects counters to only grow.
+    """
+    with _metrics_lock:
+        cumulative = RunMetrics()
+        cumulative.started_at, cumulative._start = _finished.started_at, _finished._start
+        cumulative.merge(_finished)
+        cumulative.merge(_metrics)
+    return cumulative
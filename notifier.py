@@ -1,8 +1,150 @@
 # notifier.py
+import atexit
+import logging
+import queue
+import random
+import threading
+import time
 import requests
-from utils import get_slack_webhook_url
+from metrics import get_metrics
+from utils import get_slack_webhook_url, get_slack_notify_mode, get_slack_max_retries
 
-def send_slack_notification(message):
-    webhook_url = get_slack_webhook_url()
-    payload = {'text': message}
-    requests.post(webhook_url, json=payload)
+# Slack truncates long messages, so digests are split into chunks of this size
+MAX_MESSAGE_LENGTH = 3500
+
+_STOP = object()
+
+class NotificationDispatcher:
+    """
+    Send Slack webhook notifications from a background worker thread.
+
+    In 'immediate' mode every notification is posted on its own. In 'digest'
+    mode notifications are collected until `flush` and posted as one
+    combined message, and 'digest_per_source' combines them per source.
+    Posts use a pooled session and are retried with backoff, honouring
+    Retry-After on 429 responses.
+    """
+
+    def __init__(self, webhook_url=None, mode=None, max_retries=None, session=None):
+        self.webhook_url = webhook_url or get_slack_webhook_url()
+        self.mode = mode or get_slack_notify_mode()
+        self.max_retries = get_slack_max_retries() if max_retries is None else max_retries
+        self.session = session or requests.Session()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._digest = {}
+        self._worker = threading.Thread(target=self._run, name='slack-notifier', daemon=True)
+        self._worker.start()
+
+    def notify(self, message, source=None):
+        if self.mode == 'immediate':
+            self._queue.put(message)
+            return
+        key = source if self.mode == 'digest_per_source' else None
+        with self._lock:
+            self._digest.setdefault(key, []).append(message)
+
+    def flush(self):
+        """
+        Queue the collected digest messages for sending.
+        """
+        with self._lock:
+            digest, self._digest = self._digest, {}
+        for source, messages in digest.items():
+            header = f"{len(messages)} change(s) found" + (f" in {source}" if source else "")
+            for chunk in _chunks([header] + messages):
+                self._queue.put(chunk)
+
+    def drain(self):
+        """
+        Flush the digest and wait until every queued message has been sent,
+        leaving the dispatcher running for later runs.
+        """
+        self.flush()
+        if self._worker.is_alive():
+            self._queue.join()
+
+    def close(self, timeout=None):
+        """
+        Flush the digest and wait until every queued message has been sent.
+        """
+        if not self._worker.is_alive():
+            return
+        self.flush()
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is _STOP:
+                self._queue.task_done()
+                return
+            try:
+                self._send(message)
+            except Exception as e:
+                logging.error(f"Error sending Slack notification: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _send(self, message):
+        with get_metrics().span('notify', 'slack'):
+            self._post(message)
+
+    def _post(self, message):
+        if not self.webhook_url:
+            logging.warning(f"No SLACK_WEBHOOK_URL set, dropping notification: {message}")
+            return
+
+        for attempt in range(self.max_retries + 1):
+            delay = min(60, 2 ** attempt) * random.uniform(0.5, 1.0)
+            try:
+                response = self.session.post(self.webhook_url, json={'text': message}, timeout=10)
+            except requests.RequestException as e:
+                logging.warning(f"Slack webhook request failed (attempt {attempt + 1}): {e}")
+            else:
+                if response.status_code < 400:
+                    get_metrics().inc('notifications_sent_total')
+                    return
+                if response.status_code == 429 or response.status_code >= 500:
+                    retry_after = response.headers.get('Retry-After')
+                    if retry_after and retry_after.isdigit():
+                        delay = int(retry_after)
+                    logging.warning(f"Slack webhook returned {response.status_code} (attempt {attempt + 1}), retrying in {delay:.1f}s")
+                else:
+                    logging.error(f"Slack webhook rejected notification with {response.status_code}: {response.text}")
+                    get_metrics().inc('notifications_failed_total')
+                    return
+            if attempt < self.max_retries:
+                get_metrics().inc('retries_total', target='slack')
+                time.sleep(delay)
+
+        logging.error(f"Giving up on Slack notification after {self.max_retries + 1} attempts: {message}")
+        get_metrics().inc('notifications_failed_total')
+
+def _chunks(lines):
+    chunk = ""
+    for line in lines:
+        if chunk and len(chunk) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            yield chunk
+            chunk = ""
+        chunk = f"{chunk}\n{line}" if chunk else line
+    if chunk:
+        yield chunk
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_dispatcher():
+    """
+    Return the process-wide dispatcher, starting it on first use.
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+            atexit.register(_dispatcher.close)
+        return _dispatcher
+
+def send_slack_notification(message, source=None):
+    get_dispatcher().notify(message, source)
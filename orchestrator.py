@@ -0,0 +1,89 @@
+# orchestrator.py
+import logging
+import threading
+import time
+from cancellation import CancelToken, Cancelled, use_token
+from metrics import get_metrics
+from utils import get_source_time_budget, get_source_cancel_grace
+
+class SourceResult:
+    """
+    Outcome of one source: 'ok', 'failed' (it raised), 'cancelled' (it ran
+    out of its budget and wound down) or 'abandoned' (it did not wind down
+    within the grace period and was left running).
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = 'running'
+        self.error = None
+        self.seconds = None
+
+    @property
+    def ok(self):
+        return self.status == 'ok'
+
+def _run_source(name, fn, token, result):
+    start = time.monotonic()
+    with use_token(token), get_metrics().span('total', name):
+        try:
+            fn()
+            if token.cancelled:
+                result.status, result.error = 'cancelled', Cancelled(f"{name} was cancelled: {token.reason}")
+            else:
+                result.status = 'ok'
+        except Cancelled as e:
+            result.status, result.error = 'cancelled', e
+        except Exception as e:
+            logging.exception(f"Source {name} failed: {e}")
+            result.status, result.error = 'failed', e
+    result.seconds = time.monotonic() - start
+
+def run_sources(tasks, budgets=None, grace=None, stop=None):
+    """
+    Run every `name -> fn` task concurrently, each on its own thread with
+    its own cancellation token, and return `name -> SourceResult` once all
+    of them have finished.
+
+    A task is cancelled once it exceeds its wall-clock budget. Cancellation
+    is cooperative, so a task gets `grace` further seconds to wind down
+    before it is abandoned. A failing task never affects the others.
+    Setting the `stop` event cancels every task that is still running.
+    """
+    grace = get_source_cancel_grace() if grace is None else grace
+    budgets = budgets or {}
+    running = []
+    results = {}
+
+    for name, fn in tasks.items():
+        budget = budgets.get(name) or get_source_time_budget(name)
+        token = CancelToken(name, budget)
+        result = results[name] = SourceResult(name)
+        thread = threading.Thread(target=_run_source, args=(name, fn, token, result), name=f"source-{name}", daemon=True)
+        thread.start()
+        running.append((thread, token, result, time.monotonic() + budget))
+        logging.info(f"Started source {name} with a budget of {budget:.0f}s.")
+
+    for thread, token, result, deadline in running:
+        while thread.is_alive() and time.monotonic() < deadline and not (stop and stop.is_set()):
+            thread.join(min(1, max(0, deadline - time.monotonic())))
+        if thread.is_alive():
+            if stop and stop.is_set():
+                logging.warning(f"Stopping, cancelling source {result.name}.")
+                for _, other, _, _ in running:
+                    other.cancel('stop requested')  # Let every source wind down at once
+            else:
+                logging.warning(f"Source {result.name} exceeded its budget, cancelling it.")
+                token.cancel('time budget exceeded')
+            thread.join(grace)
+        if thread.is_alive():
+            # Its token is cancelled, so it can no longer save into the generation
+            logging.error(f"Source {result.name} did not stop within {grace:.0f}s, abandoning it.")
+            result.status = 'abandoned'
+            result.error = Cancelled(f"{result.name} did not stop within {grace:.0f}s of being cancelled: {token.reason}")
+
+    metrics = get_metrics()
+    for result in results.values():
+        metrics.inc('source_runs_total', source=result.name, status=result.status)
+        logging.info(f"Source {result.name} finished with status {result.status}.")
+    return results
@@ -0,0 +1,84 @@
+# parsing.py
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Prefer the C-backed lxml parser when it is installed
+try:
+    from lxml import etree
+    HTML_PARSER = 'lxml'
+except ImportError:
+    etree = None
+    HTML_PARSER = 'html.parser'
+
+# Pages are fed to the streaming parser in chunks of this many characters
+CHUNK_SIZE = 16384
+
+def parse_subtree(html, name, **attrs):
+    """
+    Parse only the elements matching `name` and `attrs`, with their
+    descendants, instead of building a tree for the whole page.
+    """
+    return BeautifulSoup(html, HTML_PARSER, parse_only=SoupStrainer(name, attrs))
+
+def find_path_text(html, path):
+    """
+    Return the text of the element reached by `path`, a sequence of
+    `(tag, id)` steps each looked up among the descendants of the previous
+    step's element (an id of None matches any), or None if there is none.
+    As with a chain of BeautifulSoup `find` calls, only the first match of
+    each step is followed.
+
+    With lxml the page is parsed incrementally and parsing stops as soon as
+    the answer is known, usually long before the end of the page.
+    """
+    if etree is None:
+        tag, element_id = path[0]
+        node = parse_subtree(html, tag, **({'id': element_id} if element_id else {}))
+        for tag, element_id in path:
+            node = node.find(tag, id=element_id) if element_id else node.find(tag)
+            if node is None:
+                return None
+        return node.get_text()
+
+    if not html:
+        return None
+    parser = etree.HTMLPullParser(events=('start', 'end'))
+    matched = []
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start:start + CHUNK_SIZE])
+        for event, element in parser.read_events():
+            if event == 'start':
+                if len(matched) < len(path):
+                    tag, element_id = path[len(matched)]
+                    if element.tag == tag and (element_id is None or element.get('id') == element_id):
+                        matched.append(element)
+            elif matched and element is matched[-1]:
+                # The deepest match closed: either it is the answer, or
+                # the next step does not occur inside it
+                return ''.join(element.itertext()) if len(matched) == len(path) else None
+    return None
+
+def find_title(html):
+    """
+    Return the text of the page's <title>, or None if it has none.
+
+    With lxml the page is parsed incrementally and parsing stops at the
+    closing </title>, so the body is never looked at.
+    """
+    if etree is None:
+        title = parse_subtree(html, 'title').title
+        return None if title is None else title.get_text()
+
+    if not html:
+        return None
+    parser = etree.HTMLPullParser(events=('end',), tag='title')
+    for start in range(0, len(html), CHUNK_SIZE):
+        parser.feed(html[start:start + CHUNK_SIZE])
+        for _, element in parser.read_events():
+            return element.text or ''
+    try:
+        parser.close()  # Flushes a <title> left open at the end of the page
+    except etree.LxmlError:
+        return None
+    for _, element in parser.read_events():
+        return element.text or ''
+    return None
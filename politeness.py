@@ -0,0 +1,169 @@
+# politeness.py
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from resilience import RETRYABLE_STATUSES, RetryableStatus, call_with_retry, get_breaker
+from metrics import get_metrics
+from cancellation import check_cancelled, sleep
+from utils import (
+    get_politeness_initial_rate,
+    get_politeness_min_rate,
+    get_politeness_max_rate,
+    get_politeness_burst
+)
+
+# Status codes that mean the host wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header (seconds or an HTTP date) into seconds.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class HostThrottle:
+    """
+    Token bucket for a single host whose refill rate adapts AIMD-style:
+    every healthy response adds to the rate, while throttling responses,
+    errors and latency spikes cut it multiplicatively.
+    """
+
+    def __init__(self, host, rate, min_rate, max_rate, burst):
+        self.host = host
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.tokens = 1.0
+        self.blocked_until = 0.0
+        self.latency = None  # Moving average of response latency
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """
+        Block until the host may receive another request, raising Cancelled
+        if the calling source is cancelled meanwhile.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            sleep(wait)
+
+    def report(self, latency=None, status=None, retry_after=None, error=False):
+        """
+        Adapt the rate to the outcome of a request.
+        """
+        with self._lock:
+            if error or status in THROTTLE_STATUSES:
+                self.rate = max(self.min_rate, self.rate / 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+                logging.info(f"Slowing down {self.host} to {self.rate:.2f} req/s (status={status}, error={error}).")
+            elif latency is not None and self.latency is not None and latency > 2 * self.latency:
+                self.rate = max(self.min_rate, self.rate * 0.8)
+            else:
+                self.rate = min(self.max_rate, self.rate + 0.1)
+
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+
+class PolitenessScheduler:
+    """
+    Per-host throttles shared by every fetch path.
+    """
+
+    def __init__(self, initial_rate=None, min_rate=None, max_rate=None, burst=None):
+        self.initial_rate = initial_rate or get_politeness_initial_rate()
+        self.min_rate = min_rate or get_politeness_min_rate()
+        self.max_rate = max_rate or get_politeness_max_rate()
+        self.burst = burst or get_politeness_burst()
+        self._throttles = {}
+        self._lock = threading.Lock()
+
+    def throttle(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._throttles:
+                self._throttles[host] = HostThrottle(host, self.initial_rate, self.min_rate, self.max_rate, self.burst)
+            return self._throttles[host]
+
+    def acquire(self, url):
+        self.throttle(url).acquire()
+
+    def report(self, url, latency=None, status=None, retry_after=None, error=False):
+        self.throttle(url).report(latency, status, retry_after, error)
+
+    def report_response(self, url, response, latency):
+        self.report(url, latency, response.status_code, parse_retry_after(response.headers.get('Retry-After')))
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """
+    Return the process-wide politeness scheduler.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = PolitenessScheduler()
+        return _scheduler
+
+def polite_request(session, method, url, **kwargs):
+    """
+    Make an HTTP request through the politeness scheduler, waiting for the
+    host's turn first and feeding the outcome back into its rate.
+
+    Transient failures are retried with backoff behind the host's circuit
+    breaker; if a retryable status persists, the last response is returned.
+    Raises Cancelled instead if the calling source has been cancelled.
+    """
+    scheduler = get_scheduler()
+    metrics = get_metrics()
+    host = urlparse(url).netloc
+
+    def attempt():
+        check_cancelled()
+        scheduler.acquire(url)
+        start = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except Exception:
+            scheduler.report(url, error=True)
+            raise
+        latency = time.monotonic() - start
+        scheduler.report_response(url, response, latency)
+        metrics.observe('fetch_seconds', latency, host=host, transport='http')
+        metrics.inc('http_responses_total', host=host, status=response.status_code)
+        metrics.record_bytes(url, len(response.content), 'http')
+        if response.status_code in RETRYABLE_STATUSES:
+            raise RetryableStatus(response)
+        return response
+
+    try:
+        return call_with_retry(attempt, breaker=get_breaker(host))
+    except RetryableStatus as e:
+        return e.response
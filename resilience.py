@@ -0,0 +1,180 @@
+# resilience.py
+import logging
+import random
+import threading
+import time
+import requests
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from metrics import get_metrics
+from cancellation import Cancelled, sleep
+from utils import (
+    get_retry_attempts,
+    get_retry_base_delay,
+    get_retry_max_delay,
+    get_breaker_failure_threshold,
+    get_breaker_reset_timeout
+)
+
+# HTTP statuses worth retrying; anything else in the 4xx range is final
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of making a call while its circuit breaker is open.
+    """
+
+class RetryableStatus(Exception):
+    """
+    Raised for an HTTP response whose status is worth retrying.
+    """
+
+    def __init__(self, response):
+        super().__init__(f"HTTP {response.status_code} for {response.url}")
+        self.response = response
+
+class ErrorPage(Exception):
+    """
+    Raised for a page a browser rendered from an error response; unlike an
+    HTTP request, the navigation itself does not fail.
+    """
+
+    def __init__(self, url, status):
+        super().__init__(f"HTTP {status} for {url}")
+        self.url = url
+        self.status = status
+
+def _is_selenium_error(error, *names):
+    # Matched by class name, so HTTP-only runs never have to import selenium
+    return any(cls.__module__.startswith('selenium.') and cls.__name__ in names for cls in type(error).__mro__)
+
+def is_retryable(error):
+    """
+    Return True for transient errors: timeouts, dropped connections,
+    throttling and server errors. Missing elements, dead sessions and
+    client errors are not retried.
+    """
+    if isinstance(error, (CircuitOpenError, Cancelled)):
+        return False
+    if isinstance(error, RetryableStatus):
+        return True
+    if isinstance(error, ErrorPage):
+        return error.status in RETRYABLE_STATUSES
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRYABLE_STATUSES
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if _is_selenium_error(error, 'NoSuchElementException', 'InvalidSessionIdException'):
+        return False
+    if _is_selenium_error(error, 'TimeoutException', 'WebDriverException'):
+        return True
+    return isinstance(error, (Urllib3HTTPError, ConnectionError, TimeoutError))
+
+class CircuitBreaker:
+    """
+    Stop calling a host or the grid after `failure_threshold` consecutive
+    failures. After `reset_timeout` seconds a single trial call is let
+    through; its success closes the breaker again, its failure re-opens it,
+    and any other outcome leaves it half-open for the next trial.
+    """
+
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or get_breaker_failure_threshold()
+        self.reset_timeout = reset_timeout or get_breaker_reset_timeout()
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if the call must not be made, and return True
+        if it is the trial call of a half-open breaker.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self._trial_running:
+                self._trial_running = True
+                return True
+        raise CircuitOpenError(f"Circuit breaker for {self.name} is open")
+
+    def end_trial(self):
+        # A trial that neither succeeded nor failed, e.g. was cancelled, must
+        # not keep every later call out
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logging.info(f"Circuit breaker for {self.name} closed.")
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial_running or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._trial_running:
+                    logging.error(f"Circuit breaker for {self.name} opened after {self.failures} failures.")
+                    get_metrics().inc('circuit_breaker_opened_total', breaker=self.name)
+                self.opened_at = time.monotonic()
+                self._trial_running = False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """
+    Return the process-wide circuit breaker called `name`.
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+def backoff_delay(attempt, base_delay=None, max_delay=None):
+    """
+    Full-jitter exponential backoff for the given (zero-based) attempt.
+    """
+    base_delay = get_retry_base_delay() if base_delay is None else base_delay
+    max_delay = get_retry_max_delay() if max_delay is None else max_delay
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+def call_with_retry(fn, *args, breaker=None, attempts=None, **kwargs):
+    """
+    Call `fn`, retrying retryable errors with jittered exponential backoff.
+
+    With a `breaker`, calls are refused with CircuitOpenError while it is
+    open, and every retryable failure counts towards opening it.
+    """
+    attempts = attempts or get_retry_attempts()
+    target = breaker.name if breaker else getattr(fn, '__name__', 'call')
+    for attempt in range(attempts):
+        trial = breaker.before_call() if breaker else False
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            retryable = is_retryable(e)
+            if breaker and retryable:
+                breaker.record_failure()
+            elif trial:
+                breaker.end_trial()
+            if not retryable or attempt == attempts - 1:
+                get_metrics().inc('errors_total', target=target, error=type(e).__name__)
+                raise
+            get_metrics().inc('retries_total', target=target)
+            delay = backoff_delay(attempt)
+            logging.warning(f"Retrying after error (attempt {attempt + 1} of {attempts}) in {delay:.1f}s: {e}")
+            sleep(delay)
+        else:
+            if breaker:
+                breaker.record_success()
+            return result
@@ -0,0 +1,6 @@
+# scraper/__init__.py
+"""
+Source registry and command line for the scrapers, run as
+`python -m scraper`.
+"""
+from scraper.registry import SourcePlugin, register_source, get_source, get_sources
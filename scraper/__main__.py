@@ -0,0 +1,5 @@
+# scraper/__main__.py
+import sys
+from scraper.cli import main
+
+sys.exit(main())
@@ -0,0 +1,103 @@
+# scraper/cli.py
+import argparse
+import os
+import signal
+import threading
+from utils import load_environment, configure_logging
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m scraper', description='Scrape the configured registers and report changes.')
+    parser.add_argument('--env-file', help='Read settings from this file instead of .env')
+    parser.add_argument('--log-file', help="Log to this file instead of LOG_FILE, '' for stderr")
+    parser.add_argument('--log-level', help='Log level, INFO unless LOG_LEVEL is set')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Scrape sources into a new snapshot generation')
+    run.add_argument('--source', action='append', help='Source to run, may be repeated or comma-separated; every configured source by default')
+    run.add_argument('--url', help='Scrape this URL instead of the configured one; needs a single --source')
+    run.add_argument('--category', help="Categories to scrape instead of the configured ones: IDs (FMA: names or numbers), comma-separated, or 'all'; needs a single --source")
+    run.add_argument('--budget', type=float, help='Time budget in seconds for each source')
+    run.add_argument('--distributed', action='store_true', help='Hand detail pages to `worker` processes through the work queue')
+
+    worker = commands.add_parser('worker', help='Fetch detail pages queued by a distributed run')
+    worker.add_argument('--source', action='append', help='Only take work for this source, may be repeated or comma-separated')
+    worker.add_argument('--threads', type=int, help='Concurrent grid sessions, SELENIUM_DETAIL_WORKERS by default')
+    worker.add_argument('--exit-when-idle', type=float, metavar='SECONDS', help='Stop once the queue has been empty this long')
+
+    daemon = commands.add_parser('daemon', help='Keep running, scraping each source on its own interval')
+    daemon.add_argument('--source', action='append', help='Source to schedule, may be repeated or comma-separated; every configured source by default')
+    daemon.add_argument('--port', type=int, help='Port of the health and status endpoint, DAEMON_PORT by default; 0 disables it')
+
+    commands.add_parser('rollback', help='Point current_state back at the previous snapshot generation')
+
+    commands.add_parser('list', help='List the registered sources')
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    load_environment(args.env_file)
+    configure_logging(args.log_file, args.log_level)
+
+    # Sources register without importing their scrapers, so this stays cheap
+    from scraper.registry import get_sources, get_source
+
+    if args.command == 'list':
+        for plugin in get_sources():
+            status = 'configured' if plugin.configured else 'not configured'
+            print(f"{plugin.name:<20} {status:<15} {plugin.description}")
+        return 0
+
+    if args.command == 'rollback':
+        from snapshots import SnapshotGenerations
+        try:
+            print(f"Rolled back to {SnapshotGenerations().rollback()}")
+        except RuntimeError as e:
+            print(e)
+            return 1
+        return 0
+
+    sources = None
+    if args.source:
+        sources = [name.strip() for value in args.source for name in value.split(',') if name.strip()]
+        try:
+            for name in sources:
+                get_source(name)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.command == 'worker':
+        return run_worker(sources, args.threads, args.exit_when_idle)
+    if args.command == 'daemon':
+        return run_daemon(sources, args.port)
+
+    if args.distributed:
+        os.environ['DISTRIBUTED_CRAWL'] = 'true'
+    if (args.url or args.category) and (sources is None or len(sources) != 1):
+        parser.error('--url and --category need exactly one --source')
+
+    from scraper.runner import run
+    budgets = {name: args.budget for name in sources or [plugin.name for plugin in get_sources()]} if args.budget else None
+    results = run(sources, url=args.url, category=args.category, budgets=budgets)
+    return 0 if all(result.ok for result in results.values()) else 1
+
+def run_worker(sources, threads, idle_timeout):
+    from work_queue import run_worker as work
+
+    # Finish the pages in hand on Ctrl-C or SIGTERM, as sent by `docker stop`
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stop.set())
+    work(sources, threads, stop, idle_timeout)
+    return 0
+
+def run_daemon(sources, port):
+    from scraper.daemon import Daemon
+
+    daemon = Daemon(sources, port=port)
+    # Finish, or cancel, the run in progress on Ctrl-C or SIGTERM
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: daemon.stop.set())
+    daemon.run_forever()
+    return 0
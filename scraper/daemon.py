@@ -0,0 +1,191 @@
+# scraper/daemon.py
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from metrics import get_cumulative_metrics
+from notifier import get_dispatcher
+from scraper.registry import get_sources
+from scraper.runner import run
+from utils import get_source_interval, get_daemon_host, get_daemon_port, get_daemon_keepalive_interval
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+class SourceSchedule:
+    """
+    When a source last ran, how that went and when it is due again.
+    """
+
+    def __init__(self, name, interval):
+        self.name = name
+        self.interval = interval
+        self.next_run = time.monotonic()  # Every source runs once at startup
+        self.thread = None
+        self.last_started_at = None
+        self.last_status = None
+        self.last_seconds = None
+        self.runs = 0
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def status(self):
+        return {
+            'interval_seconds': self.interval,
+            'running': self.running,
+            'runs': self.runs,
+            'last_started_at': self.last_started_at,
+            'last_status': self.last_status,
+            'last_seconds': None if self.last_seconds is None else round(self.last_seconds, 3),
+            'next_run_in_seconds': round(max(0, self.next_run - time.monotonic()), 3)
+        }
+
+class Daemon:
+    """
+    Run the sources on their own intervals in one long-lived process, so
+    the interpreter, imports, grid sessions and HTTP connection pools stay
+    warm between runs.
+
+    Every source runs on its own thread, so a long crawl does not hold up
+    the sources that fall due while it runs. A source never overlaps
+    itself: if it is still running when due, it starts again once it has
+    finished. Idle grid sessions are touched every keepalive interval so
+    the grid does not time them out.
+    """
+
+    def __init__(self, sources=None, host=None, port=None):
+        plugins = [plugin for plugin in get_sources() if (plugin.name in sources if sources else plugin.configured)]
+        self.schedules = [SourceSchedule(plugin.name, get_source_interval(plugin.name)) for plugin in plugins]
+        self.host = get_daemon_host() if host is None else host
+        self.port = get_daemon_port() if port is None else port
+        self.keepalive_interval = get_daemon_keepalive_interval()
+        self.stop = threading.Event()
+        self.started_at = _now()
+        self.runs = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def run_forever(self):
+        """
+        Schedule runs until `stop` is set, then finish the runs in progress,
+        cancelling their sources, and shut down.
+        """
+        if not self.schedules:
+            logging.error("No sources to schedule.")
+            return
+        for schedule in self.schedules:
+            logging.info(f"Scheduling {schedule.name} every {schedule.interval:.0f}s.")
+        self._serve()
+
+        last_keepalive = time.monotonic()
+        try:
+            while not self.stop.is_set():
+                now = time.monotonic()
+                for schedule in self.schedules:
+                    if schedule.next_run <= now and not schedule.running:
+                        self._start(schedule)
+                # Only idle sessions are touched, so runs in progress are not disturbed
+                if now - last_keepalive >= self.keepalive_interval:
+                    self._keep_warm()
+                    last_keepalive = now
+                next_run = min(schedule.next_run for schedule in self.schedules)
+                self.stop.wait(max(0, min(1, next_run - time.monotonic())))
+        finally:
+            for schedule in self.schedules:
+                if schedule.thread is not None:
+                    schedule.thread.join()
+            self._shutdown()
+
+    def _start(self, schedule):
+        schedule.last_started_at = _now()
+        schedule.thread = threading.Thread(target=self._run, args=(schedule,), name=f"run-{schedule.name}")
+        schedule.thread.start()
+
+    def _run(self, schedule):
+        start = time.monotonic()
+        logging.info(f"Starting run of {schedule.name}.")
+        try:
+            results = run([schedule.name], stop=self.stop, keep_sessions=True)  # Keep the sessions warm for the next run
+        except Exception as e:
+            logging.exception(f"Run of {schedule.name} failed: {e}")
+            results = {}
+
+        result = results.get(schedule.name)
+        schedule.last_status = result.status if result else 'failed'
+        schedule.last_seconds = result.seconds if result else time.monotonic() - start
+        schedule.runs += 1
+        # Measured from the start of the run, so the schedule does not drift
+        schedule.next_run = start + schedule.interval
+        with self._lock:
+            self.runs += 1
+
+    def _keep_warm(self):
+        # Only sources that use the browser have pools, and only once they have run
+        driver_pool = sys.modules.get('driver_pool')
+        if driver_pool is None:
+            return
+        for pool in driver_pool.get_driver_pools():
+            try:
+                pool.keep_warm()
+            except Exception as e:
+                logging.warning(f"Error keeping WebDriver sessions warm: {e}")
+
+    def status(self):
+        return {
+            'started_at': self.started_at,
+            'stopping': self.stop.is_set(),
+            'runs': self.runs,
+            'running': [schedule.name for schedule in self.schedules if schedule.running],
+            'sources': {schedule.name: schedule.status() for schedule in self.schedules}
+        }
+
+    def _serve(self):
+        if not self.port:
+            return
+        self._server = ThreadingHTTPServer((self.host, self.port), _StatusHandler)
+        self._server.daemon_threads = True
+        self._server.scraper_daemon = self
+        threading.Thread(target=self._server.serve_forever, name='status-server', daemon=True).start()
+        logging.info(f"Serving /health, /status and /metrics on {self.host}:{self.port}.")
+
+    def _shutdown(self):
+        logging.info("Shutting down.")
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        get_dispatcher().close()
+        driver_pool = sys.modules.get('driver_pool')
+        if driver_pool is not None:
+            for pool in driver_pool.get_driver_pools():
+                pool.close()
+
+class _StatusHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        daemon = self.server.scraper_daemon
+        if self.path == '/health':
+            stopping = daemon.stop.is_set()
+            self._reply(503 if stopping else 200, 'text/plain', 'stopping' if stopping else 'ok')
+        elif self.path == '/status':
+            self._reply(200, 'application/json', json.dumps(daemon.status(), indent=2))
+        elif self.path == '/metrics':
+            self._reply(200, 'text/plain; version=0.0.4', get_cumulative_metrics().prometheus_text())
+        else:
+            self._reply(404, 'text/plain', 'not found')
+
+    def _reply(self, code, content_type, body):
+        body = body.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep health checks out of the log at the default level
+        logging.debug(f"Status request: {format % args}")
@@ -0,0 +1,109 @@
+# scraper/registry.py
+import importlib
+import logging
+import threading
+from utils import (
+    get_scraper_plugins,
+    get_simple_urls,
+    get_fma_url,
+    get_bafin_db_company_url,
+    get_bafin_institution_url,
+    get_bafin_db_company_category_id,
+    get_bafin_institution_category_id
+)
+
+class SourcePlugin:
+    """
+    A source the scraper can run.
+
+    `target` names the source's run function as 'module:function'. The
+    module is only imported when the source is run, so selecting one source
+    never pulls in the dependencies of the others. The function is called
+    as `fn(context, url=None, category=None)` and writes into the run's
+    snapshot; `snapshot_dir` is where its files live in a snapshot, '' for
+    the top level.
+    """
+
+    def __init__(self, name, target, snapshot_dir, is_configured=None, description=''):
+        self.name = name
+        self.target = target
+        self.snapshot_dir = snapshot_dir
+        self.is_configured = is_configured
+        self.description = description
+
+    @property
+    def configured(self):
+        # Whether the .env has what the source needs to run without overrides
+        return self.is_configured is None or bool(self.is_configured())
+
+    def owns(self, path):
+        if not self.snapshot_dir:
+            return '/' not in path
+        return path.startswith(f"{self.snapshot_dir}/")
+
+    def load(self):
+        module_name, _, function_name = self.target.partition(':')
+        return getattr(importlib.import_module(module_name), function_name)
+
+_sources = {}
+_lock = threading.Lock()
+_plugins_loaded = False
+
+def register_source(name, target, snapshot_dir, is_configured=None, description=''):
+    """
+    Add a source to the registry, replacing any source of the same name.
+    """
+    plugin = SourcePlugin(name, target, snapshot_dir, is_configured, description)
+    with _lock:
+        _sources[name] = plugin
+    return plugin
+
+def _load_plugins():
+    # Modules listed in SCRAPER_PLUGINS register their sources on import
+    global _plugins_loaded
+    with _lock:
+        if _plugins_loaded:
+            return
+        _plugins_loaded = True
+    for module_name in get_scraper_plugins():
+        try:
+            importlib.import_module(module_name)
+        except Exception as e:
+            logging.error(f"Error loading scraper plugin {module_name}: {e}")
+
+def get_sources():
+    """
+    Return every registered source, in registration order.
+    """
+    _load_plugins()
+    with _lock:
+        return list(_sources.values())
+
+def get_source(name):
+    _load_plugins()
+    with _lock:
+        plugin = _sources.get(name)
+    if plugin is None:
+        raise ValueError(f"Unknown source {name!r}, expected one of: {', '.join(_sources)}")
+    return plugin
+
+register_source(
+    'simple', 'simple_scraper:run', '',
+    is_configured=get_simple_urls,
+    description='Plain pages listed in SIMPLE_URLS'
+)
+register_source(
+    'fma', 'fma_scraper:run', 'fma',
+    is_configured=get_fma_url,
+    description='FMA company database'
+)
+register_source(
+    'bafin_company', 'bafin_company_scraper:run', 'bafin/BAFIN_DB_COMPANY',
+    is_configured=lambda: get_bafin_db_company_url() and get_bafin_db_company_category_id(),
+    description='BaFin company database'
+)
+register_source(
+    'bafin_institution', 'bafin_institution_scraper:run', 'bafin/BAFIN_INSTITUTION',
+    is_configured=lambda: get_bafin_institution_url() and get_bafin_institution_category_id(),
+    description='BaFin payment and e-money institution register'
+)
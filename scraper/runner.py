@@ -0,0 +1,203 @@
+# scraper/runner.py
+import logging
+import os
+import sys
+import threading
+from functools import partial
+from manifest import open_snapshot, close_snapshot, load_manifest, carry_over, diff_manifests
+from crawl_state import get_crawl_state
+from snapshots import SnapshotGenerations
+from notifier import send_slack_notification, get_dispatcher
+from metrics import get_metrics, start_run
+from orchestrator import run_sources
+from fetch_cache import get_fetch_cache
+from scraper.registry import get_sources
+
+# Held while a run folds in the sources it did not run and promotes its
+# generation, so runs of different sources can overlap
+_finish_lock = threading.Lock()
+
+class RunContext:
+    """
+    The snapshot generation a run writes into, handed to every source.
+    """
+
+    def __init__(self, base_path, current_manifest, new_manifest, first_run):
+        self.base_path = base_path
+        self.current_manifest = current_manifest
+        self.new_manifest = new_manifest
+        self.first_run = first_run
+        self._on_promote = []
+
+    def on_promote(self, fn):
+        """
+        Call `fn` once the run's snapshot has become current, or was
+        discarded because it matched the current one. State describing what
+        the snapshot holds is saved there, so it never runs ahead of it.
+        """
+        self._on_promote.append(fn)
+
+    def promoted(self):
+        for fn in self._on_promote:
+            try:
+                fn()
+            except Exception as e:
+                logging.exception(f"Error finishing the run: {e}")
+
+def run(sources=None, url=None, category=None, budgets=None, stop=None, keep_sessions=False):
+    """
+    Scrape `sources` (registered source names, by default every configured
+    one) into a new snapshot generation, report the changes against the
+    current one and promote it. Setting `stop` cancels the running sources.
+    Browser sessions are quit at the end of the run unless `keep_sessions`
+    is set, as it is by the daemon, which reuses them between runs.
+
+    Sources that are not run, and the entries of a source run only for one
+    `url` or `category`, are carried over from the current generation, so a
+    partial run never reports the rest as removed. Runs of different sources
+    may overlap: each carries the others over from whichever generation is
+    current when it finishes.
+    """
+    plugins = get_sources()
+    if sources is None:
+        selected = [plugin for plugin in plugins if plugin.configured]
+    else:
+        selected = [plugin for plugin in plugins if plugin.name in sources]
+    partial_run = bool(url or category)
+    start_run()  # The report and metrics files cover this run only
+
+    generations = SnapshotGenerations()
+    current_path = generations.current()
+    first_run = current_path is None
+
+    # Every run writes a fresh generation; it only becomes current once complete
+    base_path = generations.create()
+    new_manifest = open_snapshot(base_path)
+    current_manifest = None if first_run else load_manifest(current_path)
+    if first_run:
+        get_crawl_state().clear([plugin.name for plugin in selected])
+    context = RunContext(base_path, current_manifest, new_manifest, first_run)
+
+    # The registers are independent, so scrape them side by side. Each
+    # source's module is only imported here, once it has been selected
+    tasks = {plugin.name: partial(plugin.load(), context, url=url, category=category) for plugin in selected}
+    results = run_sources(tasks, budgets, stop=stop)
+
+    for result in results.values():
+        if not result.ok:
+            send_slack_notification(f"Scraping {result.name} did not complete ({result.status}): {result.error}", result.name)
+
+    with _finish_lock:
+        # Runs of other sources may have promoted a generation in the meantime;
+        # their entries are only up to date in that one
+        latest_path = generations.current()
+        if latest_path is None or latest_path == current_path:
+            latest_manifest = current_manifest
+        else:
+            latest_manifest = load_manifest(latest_path)
+
+        # Keep the pages that were not re-fetched, or failed to fetch, in the new snapshot
+        if latest_manifest:
+            crawl_state = get_crawl_state()
+            skipped_rows = {}
+            for source, category, page_url, path in crawl_state.unfetched_pages(list(tasks)):
+                if path.endswith('.parquet'):
+                    skipped_rows.setdefault((source, category, path), []).append(page_url)
+                elif not carry_over(latest_manifest, new_manifest, path):
+                    crawl_state.forget(source, category, page_url)
+            if skipped_rows:
+                from snapshot_store import carry_over_rows  # Only columnar snapshots need pandas
+                for (source, category, path), urls in skipped_rows.items():
+                    for page_url in carry_over_rows(latest_manifest, new_manifest, path, urls):
+                        crawl_state.forget(source, category, page_url)
+
+            # A source that failed, was cancelled or was not run keeps its last
+            # known state, rather than having whatever it did not get to
+            # reported as removed
+            for plugin in plugins:
+                result = results.get(plugin.name)
+                if result is None or not result.ok or partial_run:
+                    carry_over_source(latest_manifest, new_manifest, plugin.name)
+
+        close_snapshot(base_path)
+
+        # Compare against the current generation and promote the new one, only
+        # once every source has finished. A first run has nothing of its own
+        # to compare against, even if another source's run got there first
+        if first_run or latest_path is None:
+            generations.promote(base_path)
+        else:
+            compare_and_manage_directories(generations, latest_path, base_path)
+        context.promoted()
+
+    # Send the digest, if any, and wait for queued notifications to go out
+    get_dispatcher().drain()
+
+    # Sessions are only recorded once quit, so quit them before the report
+    # is written. driver_pool is only loaded if a source drove a browser
+    driver_pool = sys.modules.get('driver_pool')
+    if driver_pool and not keep_sessions:
+        driver_pool.close_driver_pools()
+
+    # Write the run report and the Prometheus metrics for this run
+    get_metrics().export()
+
+    # Pages are only shared within a run
+    get_fetch_cache().clear()
+    return results
+
+def carry_over_source(current_manifest, new_manifest, source):
+    for path in list(current_manifest.entries):
+        if source_of(path) == source:
+            carry_over(current_manifest, new_manifest, path)
+
+def compare_and_manage_directories(generations, base_path_current, base_path_new):
+    # Compare the snapshots by digest, without reading any CSV
+    metrics = get_metrics()
+    with metrics.span('diff'):
+        current_manifest = load_manifest(base_path_current)
+        new_manifest = load_manifest(base_path_new)
+        changes = diff_manifests(current_manifest, new_manifest)
+
+    with metrics.span('notify'):
+        for path in changes['added']:
+            send_slack_notification(f'New entry found: {path}', source_of(path))
+        for path in changes['modified']:
+            if path.endswith('.parquet'):
+                notify_snapshot_changes(path, os.path.join(base_path_current, path), os.path.join(base_path_new, path))
+            else:
+                send_slack_notification(f'Difference found in {path}', source_of(path))
+        for path in changes['removed']:
+            send_slack_notification(f'Entry removed: {path}', source_of(path))
+
+    # Entries missing from the new snapshot that were not reported as removed
+    # belong to sources that failed this run; keep their last known state
+    removed = set(changes['removed'])
+    for path in list(current_manifest.entries):
+        if path not in new_manifest.entries and path not in removed:
+            carry_over(current_manifest, new_manifest, path)
+
+    if any(changes.values()):
+        new_manifest.save()
+        generations.promote(base_path_new)
+    else:
+        print("No changes found.")
+        generations.discard(base_path_new)
+
+def notify_snapshot_changes(path, current_file, new_file):
+    # A columnar snapshot holds a whole category, so report the individual rows
+    from snapshot_store import read_snapshot, diff_snapshots
+    rows = diff_snapshots(read_snapshot(current_file), read_snapshot(new_file))
+    for link in rows['added']:
+        send_slack_notification(f'New entry in {path}: {link}', source_of(path))
+    for link in rows['changed']:
+        send_slack_notification(f'Difference found in {path}: {link}', source_of(path))
+    for link in rows['removed']:
+        send_slack_notification(f'Entry removed from {path}: {link}', source_of(path))
+
+def source_of(path):
+    # The registered source whose snapshot directory holds the path
+    for plugin in get_sources():
+        if plugin.owns(path):
+            return plugin.name
+    return path.split('/')[0]
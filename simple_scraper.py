@@ -1,11 +1,32 @@
 import requests
-from bs4 import BeautifulSoup
-import pandas as pd
 import os
-from dotenv import load_dotenv
+import threading
+from functools import partial
+from utils import get_http_timeout, get_simple_max_workers
+from http_cache import ValidatorCache, body_digest
+from manifest import record_file, carry_over, replacing
+from fetch_engine import FetchEngine, create_session
+from blob_store import content_fields
+from politeness import polite_request
+from metrics import get_metrics
 
-# Load environment variables from .env file
-load_dotenv()
+# Returned instead of data when the server (or the body digest) says the page
+# has not changed since the last run
+NOT_MODIFIED = object()
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_simple_session():
+    """
+    Return the process-wide session for the simple pages. It stays open
+    between runs, so a long-running scraper reuses its connections.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session(get_simple_max_workers())
+        return _session
 
 def get_simple_urls():
     """
@@ -18,20 +39,39 @@ def get_simple_urls():
         print("No SIMPLE_URLS found in the .env file.")
         return []
 
-def scrape_simple_site(url):
+def scrape_simple_site(url, session=None, cache=None, conditional=True):
     """
-    Scrape data from the given URL.
+    Scrape data from the given URL, reusing `session` when one is given.
+
+    When a validator `cache` is given the request is made conditional, and
+    NOT_MODIFIED is returned if the page is unchanged since the last run;
+    the new validators are staged in the cache. With `conditional` off the
+    page is always fetched and returned in full.
     """
     print(f"Processing URL: {url}")
     try:
-        response = requests.get(url)
+        http = session or requests
+        headers = cache.conditional_headers(url) if cache and conditional else {}
+        with get_metrics().span('detail_fetch', 'simple'):
+            response = polite_request(http, 'GET', url, headers=headers, timeout=get_http_timeout())
+        if response.status_code == 304:
+            print(f"Not modified: {url}")
+            return NOT_MODIFIED
         response.raise_for_status()  # Raise an error for bad responses
-        soup = BeautifulSoup(response.text, 'html.parser')
 
-        # Extract the entire HTML content
+        if cache:
+            digest = body_digest(response.content)
+            unchanged = conditional and cache.is_unchanged(url, digest)
+            cache.stage(url, response, digest)
+            if unchanged:
+                print(f"Unchanged content: {url}")
+                return NOT_MODIFIED
+
+        # Keep the HTML exactly as served; parsing and re-serialising it
+        # would only cost CPU and normalise away real changes
         data = {
             'url': url,
-            'html_content': str(soup)  # Capture the entire HTML as a string
+            'html_content': response.text
         }
 
         print(f"Successfully scraped: {url}")
@@ -48,6 +88,53 @@ def save_data(data, file_path):
         print(f"\nNo data to save for {file_path}\n")
         return
 
-    df = pd.DataFrame([data])  # Create a DataFrame from the data
-    df.to_csv(file_path, index=False)
+    import pandas as pd  # Deferred, so re-checking unchanged pages never loads pandas
+
+    # Store the page HTML inline, or as a reference into the blob store
+    row = dict(data)
+    row.update(content_fields(row.pop('html_content'), 'html_content'))
+    df = pd.DataFrame([row])  # Create a DataFrame from the data
+    with replacing(file_path) as tmp_path:
+        df.to_csv(tmp_path, index=False)
+    record_file(file_path)
     print(f"Saved data to {file_path}\n")
+
+def run(context, url=None, category=None):
+    """
+    Fetch the simple pages, or only `url`, into the run's snapshot.
+    """
+    # Process simple URLs concurrently, handling each result as it arrives
+    # On the first run there is no stored state, so every page must be fetched in full
+    urls = [url] if url else get_simple_urls()
+    metrics = get_metrics()
+    validator_cache = ValidatorCache()
+    if context.first_run:
+        validator_cache.clear()
+    # The validators describe the saved pages, so they are only kept once
+    # the snapshot holding them is current
+    context.on_promote(validator_cache.commit)
+    engine = FetchEngine(session=get_simple_session())
+    fetch_simple_site = partial(scrape_simple_site, cache=validator_cache)
+    for url, data in engine.fetch_all(urls, fetch_simple_site):
+        safe_url = url.replace('https://', '').replace('http://', '').replace('/', '_').replace('?', '_').replace('&', '_')
+        file_name = f"{safe_url}.csv"
+        if data is NOT_MODIFIED or not data:
+            if not data:
+                print(f"No data returned for {url}\n")
+            # Keep the unchanged, or for now unreachable, page in the new
+            # snapshot without re-reading it
+            if context.current_manifest and carry_over(context.current_manifest, context.new_manifest, file_name):
+                continue
+            if data is not NOT_MODIFIED:
+                continue
+            # The cache says unchanged but the last snapshot lacks the page,
+            # e.g. because saving it failed, so fetch it again in full
+            data = scrape_simple_site(url, engine.session, validator_cache, conditional=False)
+            if not data:
+                continue
+        try:
+            with metrics.span('save', 'simple'):
+                save_data(data, f'{context.base_path}/{file_name}')
+        except Exception:
+            validator_cache.unstage(url)  # Not saved, so the next run must fetch it in full
+            raise
@@ -0,0 +1,128 @@
+# snapshot_store.py
+import logging
+import os
+import re
+import pandas as pd
+from crawl_state import get_crawl_state
+from blob_store import get_blob_store
+from http_cache import body_digest
+from manifest import record_file, replacing
+from metrics import get_metrics
+from urls import canonical_url
+from utils import get_storage_backend, get_blob_store_enabled
+
+COLUMNS = ['link', 'category', 'title', 'content', 'digest']
+
+def use_columnar_storage():
+    return get_storage_backend() == 'parquet'
+
+def snapshot_file_name(category):
+    return re.sub(r'[<>:"/\\|?*]', '_', category) + '.parquet'
+
+def write_snapshot(file_path, records):
+    """
+    Write the records of one source category as a single Parquet file,
+    keyed and sorted by link, and return the written DataFrame.
+    """
+    df = pd.DataFrame.from_records(records)
+    for column in COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+    missing_digest = df['digest'].isna()
+    df.loc[missing_digest, 'digest'] = df.loc[missing_digest, 'content'].fillna('').map(body_digest)
+    if get_blob_store_enabled():
+        # Keep only the blob reference; the digest is the blob's key
+        for content in df.loc[df['content'].notna(), 'content']:
+            get_blob_store().put(content)
+        df['content'] = None
+    df = df[COLUMNS].drop_duplicates('link', keep='last').sort_values('link')
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with replacing(file_path) as tmp_path:
+        df.to_parquet(tmp_path, index=False)
+    return df
+
+def read_snapshot(file_path):
+    return pd.read_parquet(file_path)
+
+def compact_record(record):
+    """
+    Return the record as its category file will keep it: with its digest,
+    and with the content moved into the blob store when that is enabled.
+    """
+    record = dict(record)
+    content = record.get('content')
+    if record.get('digest') is None:
+        record['digest'] = body_digest(content or '')
+    if content is not None and get_blob_store_enabled():
+        get_blob_store().put(content)
+        record['content'] = None
+    return record
+
+def save_records(base_path, source_dir, records, source=None):
+    """
+    Save scraped records as one Parquet file per category under
+    `base_path/source_dir`, and record every page in the crawl state.
+
+    `records` may be a generator: each record is compacted as it arrives,
+    so with the blob store enabled only the small row fields are held until
+    the category files are written.
+    """
+    records_by_category = {}
+    for record in records:
+        records_by_category.setdefault(record['category'], []).append(compact_record(record))
+
+    for category, category_records in records_by_category.items():
+        file_path = os.path.join(base_path, source_dir, snapshot_file_name(category))
+        with get_metrics().span('save', source):
+            write_snapshot(file_path, category_records)
+            relative_path = record_file(file_path)
+        logging.info(f"Saved {len(category_records)} records to {file_path}")
+
+        crawl_state = get_crawl_state()
+        for record in category_records:
+            crawl_state.record_fetch(source, category, record['link'], None, record.get('title'), relative_path, digest=record['digest'])
+
+def diff_snapshots(old, new):
+    """
+    Compare two snapshots of the same category with a single join on link,
+    returning the added, removed and changed links.
+    """
+    merged = old[['link', 'digest']].merge(
+        new[['link', 'digest']], on='link', how='outer', suffixes=('_old', '_new'), indicator=True
+    )
+    both = merged['_merge'] == 'both'
+    return {
+        'added': merged.loc[merged['_merge'] == 'right_only', 'link'].tolist(),
+        'removed': merged.loc[merged['_merge'] == 'left_only', 'link'].tolist(),
+        'changed': merged.loc[both & (merged['digest_old'] != merged['digest_new']), 'link'].tolist()
+    }
+
+def carry_over_rows(old_manifest, new_manifest, relative_path, links):
+    """
+    Copy the rows for `links` from a category file of the old snapshot into
+    the same file of the new one, used for pages the incremental crawl did
+    not re-fetch. Links are matched by canonical URL. Returns the links that
+    could not be found.
+    """
+    old_path = os.path.join(old_manifest.root, relative_path)
+    if not os.path.exists(old_path):
+        return list(links)
+
+    old = read_snapshot(old_path)
+    links = {canonical_url(link) for link in links}
+    old_links = old['link'].map(canonical_url)
+    kept = old[old_links.isin(links)]
+    missing = sorted(links - set(old_links))
+    if kept.empty:
+        return missing
+
+    new_path = os.path.join(new_manifest.root, relative_path)
+    if os.path.exists(new_path):
+        # Freshly fetched rows win over carried-over ones
+        new = read_snapshot(new_path)
+        kept = kept[~kept['link'].map(canonical_url).isin(set(new['link'].map(canonical_url)))]
+        kept = pd.concat([new, kept], ignore_index=True)
+    write_snapshot(new_path, kept.to_dict('records'))
+    new_manifest.record(new_path)
+    return missing
@@ -0,0 +1,140 @@
+# snapshots.py
+import logging
+import os
+import shutil
+import threading
+from datetime import datetime, timezone
+from utils import get_uploads_dir, get_snapshot_generations_keep
+
+# Generations being written by runs in this process, which may overlap
+_active = set()
+_active_lock = threading.Lock()
+
+class SnapshotGenerations:
+    """
+    Versioned snapshot directories under `uploads/generations`.
+
+    Every run writes into a fresh generation. `uploads/current_state` is a
+    symlink to the promoted generation and is swapped in a single atomic
+    rename, so readers always see one complete snapshot. The newest `keep`
+    generations are kept for rollback; the current one is always kept, so
+    with `keep` 0 it is the only one.
+    """
+
+    def __init__(self, root=None, keep=None):
+        self.root = root or get_uploads_dir()
+        self.keep = max(0, get_snapshot_generations_keep() if keep is None else keep)
+        self.generations_dir = os.path.join(self.root, 'generations')
+        self.current_link = os.path.join(self.root, 'current_state')
+        os.makedirs(self.generations_dir, exist_ok=True)
+        self._migrate_legacy_state()
+
+    def _migrate_legacy_state(self):
+        # Older runs kept the state in a plain current_state directory and
+        # used current_state2 as scratch space
+        if os.path.isdir(self.current_link) and not os.path.islink(self.current_link):
+            name = f"{self._timestamp()}-legacy"
+            os.rename(self.current_link, os.path.join(self.generations_dir, name))
+            self._point_to(name)
+            logging.info(f"Migrated legacy current_state into generation {name}.")
+        legacy_scratch = os.path.join(self.root, 'current_state2')
+        if os.path.isdir(legacy_scratch):
+            shutil.rmtree(legacy_scratch)
+
+    def _timestamp(self):
+        return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+
+    def _marker(self, path):
+        return f"{path}.incomplete"
+
+    def _point_to(self, name):
+        # Build the new link next to the old one, then rename it over the old
+        # one; rename is atomic, so there is never a missing or partial state
+        tmp_link = f"{self.current_link}.tmp"
+        if os.path.lexists(tmp_link):
+            os.remove(tmp_link)
+        os.symlink(os.path.join('generations', name), tmp_link)
+        os.replace(tmp_link, self.current_link)
+
+    def generations(self):
+        """
+        Return the paths of all complete generations, oldest first.
+        """
+        names = sorted(
+            name for name in os.listdir(self.generations_dir)
+            if os.path.isdir(os.path.join(self.generations_dir, name))
+            and not os.path.exists(self._marker(os.path.join(self.generations_dir, name)))
+        )
+        return [os.path.join(self.generations_dir, name) for name in names]
+
+    def current(self):
+        """
+        Return the path of the promoted generation, or None before the first run.
+        """
+        if not os.path.islink(self.current_link) or not os.path.isdir(self.current_link):
+            return None
+        return os.path.join(self.generations_dir, os.path.basename(os.readlink(self.current_link)))
+
+    def create(self):
+        """
+        Create an empty generation for this run and return its path.
+        """
+        with _active_lock:
+            self._remove_incomplete()
+            path = os.path.join(self.generations_dir, self._timestamp())
+            os.makedirs(path)
+            open(self._marker(path), 'w').close()
+            _active.add(os.path.abspath(path))
+        logging.info(f"Created snapshot generation {path}.")
+        return path
+
+    def promote(self, path):
+        """
+        Make `path` the current generation and prune old generations.
+        """
+        marker = self._marker(path)
+        if os.path.exists(marker):
+            os.remove(marker)
+        with _active_lock:
+            _active.discard(os.path.abspath(path))
+        self._point_to(os.path.basename(path))
+        logging.info(f"Promoted snapshot generation {path}.")
+        self.prune()
+
+    def discard(self, path):
+        shutil.rmtree(path, ignore_errors=True)
+        marker = self._marker(path)
+        if os.path.exists(marker):
+            os.remove(marker)
+        with _active_lock:
+            _active.discard(os.path.abspath(path))
+
+    def rollback(self):
+        """
+        Point current_state back at the generation before the current one.
+        """
+        generations = self.generations()
+        current = self.current()
+        if current not in generations or generations.index(current) == 0:
+            raise RuntimeError("No earlier snapshot generation to roll back to.")
+        previous = generations[generations.index(current) - 1]
+        self._point_to(os.path.basename(previous))
+        logging.info(f"Rolled back to snapshot generation {previous}.")
+        return previous
+
+    def prune(self):
+        current = self.current()
+        generations = self.generations()
+        # Slicing with [:-keep] would prune nothing for keep 0
+        for path in generations[:len(generations) - self.keep]:
+            if path != current:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _remove_incomplete(self):
+        # Generations still marked incomplete belong to runs that died,
+        # unless a run in this process is still writing them
+        for name in os.listdir(self.generations_dir):
+            path = os.path.join(self.generations_dir, name[:-len('.incomplete')])
+            if name.endswith('.incomplete') and os.path.abspath(path) not in _active:
+                shutil.rmtree(path, ignore_errors=True)
+                os.remove(os.path.join(self.generations_dir, name))
@@ -0,0 +1,69 @@
+# urls.py
+import re
+from urllib.parse import urljoin, urlsplit, urlunsplit, parse_qsl, urlencode
+from utils import get_url_locale
+
+# Query parameters that identify the visitor's session rather than the page
+SESSION_PARAMS = {'jsessionid', 'phpsessid', 'sid', 'sessionid', 'cfid', 'cftoken'}
+
+# Query parameters that only choose the interface language
+LOCALE_PARAMS = {'locale', 'lang', 'language'}
+
+# An ampersand escaped as an HTML entity, as left in hrefs that were escaped twice
+_ESCAPED_AMPERSAND = re.compile(r'&(?:amp|#38|#x26);', re.IGNORECASE)
+
+# A session ID in a path segment, e.g. /detail.do;jsessionid=0A1B2C
+_PATH_SESSION = re.compile(r';(?:jsessionid|phpsessid|sid|sessionid)=[^/?#]*', re.IGNORECASE)
+
+def resolve_url(url, base=None):
+    """
+    Resolve `url` against `base` the way a browser resolves an href, with
+    escaped ampersands decoded. This is the URL to fetch.
+    """
+    url = url.strip()
+    while _ESCAPED_AMPERSAND.search(url):
+        url = _ESCAPED_AMPERSAND.sub('&', url)
+    return urljoin(base, url) if base else url
+
+def canonical_url(url, base=None):
+    """
+    Return the canonical form of `url`, resolved with resolve_url: with
+    scheme and host lower-cased, default ports, session IDs and the
+    fragment dropped, locale parameters set to URL_LOCALE and the query
+    sorted.
+
+    Two links to the same page give the same canonical URL, so it keys the
+    crawl state and the fetch cache. It is never fetched, since the site
+    may not accept the rewritten parameters.
+    """
+    url = resolve_url(url, base)
+
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, netloc.rpartition(':')[2]) in (('http', '80'), ('https', '443')):
+        netloc = netloc.rpartition(':')[0]
+    path = _PATH_SESSION.sub('', parts.path) or '/'
+
+    locale = get_url_locale()
+    query = []
+    for name, value in parse_qsl(parts.query, keep_blank_values=True):
+        if name.lower() in SESSION_PARAMS:
+            continue
+        if name.lower() in LOCALE_PARAMS:
+            if not locale:
+                continue
+            value = locale
+        query.append((name, value))
+    query.sort()
+
+    return urlunsplit((scheme, netloc, path, urlencode(query), ''))
+
+def rebase_url(url, base):
+    """
+    Return `url`'s last path segment and query resolved under the directory
+    `base`.
+    """
+    parts = urlsplit(url)
+    page = parts.path.rstrip('/').rpartition('/')[2]
+    return resolve_url(f"{page}?{parts.query}" if parts.query else page, f"{base.rstrip('/')}/")
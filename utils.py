@@ -1,9 +1,31 @@
 # utils.py
+import logging
 import os
 from dotenv import load_dotenv
-import pandas as pd
+from manifest import file_digest
 
-load_dotenv()
+def load_environment(env_file=None):
+    """
+    Load settings from the .env file. Variables already set in the
+    environment take precedence.
+    """
+    load_dotenv(env_file)
+
+def configure_logging(log_file=None, level=None):
+    # An empty LOG_FILE logs to stderr
+    log_file = get_log_file() if log_file is None else log_file
+    logging.basicConfig(filename=log_file or None, level=(level or get_log_level()).upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+def get_log_file():
+    return os.getenv('LOG_FILE', 'scraper.log')
+
+def get_log_level():
+    return os.getenv('LOG_LEVEL', 'INFO')
+
+def get_scraper_plugins():
+    # Comma-separated modules that register extra sources when imported
+    plugins = os.getenv('SCRAPER_PLUGINS')
+    return [plugin.strip() for plugin in plugins.split(',') if plugin.strip()] if plugins else []
 
 def get_env_variable(var_name):
     return os.getenv(var_name)
@@ -19,28 +41,226 @@ def get_bafin_db_company_url():
     return os.getenv('BAFIN_DB_COMPANY')
 
 def get_bafin_db_company_category_id():
+    # A category ID, a comma-separated list of them, or 'all'
     return os.getenv('BAFIN_DB_COMPANY_CATEGORY_ID')
 
 def get_bafin_institution_url():
     return os.getenv('BAFIN_INSTITUTION')
 
 def get_bafin_institution_category_id():
+    # A category ID, a comma-separated list of them, or 'all'
     return os.getenv('BAFIN_INSTITUTION_CATEGORY_ID')
 
+def get_bafin_search_button_label():
+    return os.getenv('BAFIN_SEARCH_BUTTON_LABEL', 'Suche')
+
 def get_slack_webhook_url():
     return os.getenv('SLACK_WEBHOOK_URL')
 
-def create_directories(first_run):
-    if first_run:
-        if not os.path.exists('uploads/current_state'):
-            os.makedirs('uploads/current_state')
-    else:
-        if not os.path.exists('uploads/current_state2'):
-            os.makedirs('uploads/current_state2')
+def get_slack_notify_mode():
+    # 'immediate', 'digest' or 'digest_per_source'
+    return os.getenv('SLACK_NOTIFY_MODE', 'immediate').lower()
+
+def get_slack_max_retries():
+    return int(os.getenv('SLACK_MAX_RETRIES', '5'))
+
+def get_http_timeout():
+    return float(os.getenv('HTTP_TIMEOUT', '30'))
+
+def get_http_cache_path():
+    return os.getenv('HTTP_CACHE_PATH', os.path.join(get_uploads_dir(), 'http_cache.json'))
+
+def get_simple_max_workers():
+    return int(os.getenv('SIMPLE_MAX_WORKERS', '8'))
+
+def get_simple_per_host_limit():
+    return int(os.getenv('SIMPLE_PER_HOST_LIMIT', '2'))
+
+def get_politeness_initial_rate():
+    # Requests per second per host at the start of a run
+    return float(os.getenv('POLITENESS_INITIAL_RATE', '1'))
+
+def get_politeness_min_rate():
+    return float(os.getenv('POLITENESS_MIN_RATE', '0.05'))
+
+def get_politeness_max_rate():
+    return float(os.getenv('POLITENESS_MAX_RATE', '10'))
+
+def get_politeness_burst():
+    return float(os.getenv('POLITENESS_BURST', '1'))
+
+def get_scrape_mode(source):
+    # 'selenium' or 'http', set per source (e.g. FMA_SCRAPE_MODE) or globally
+    return os.getenv(f'{source}_SCRAPE_MODE', os.getenv('SCRAPE_MODE', 'selenium')).lower()
+
+def get_http_pool_size():
+    return int(os.getenv('HTTP_POOL_SIZE', '10'))
+
+def get_http_per_host_limit():
+    return int(os.getenv('HTTP_PER_HOST_LIMIT', '4'))
+
+
+def get_crawl_state_path():
+    return os.getenv('CRAWL_STATE_PATH', os.path.join(get_uploads_dir(), 'crawl_state.sqlite3'))
+
+def get_incremental_crawl():
+    return os.getenv('INCREMENTAL_CRAWL', 'false').lower() in ('1', 'true', 'yes')
+
+def get_crawl_reverify_fraction():
+    return float(os.getenv('CRAWL_REVERIFY_FRACTION', '0.1'))
+
+def get_storage_backend():
+    # 'csv' writes one file per record, 'parquet' one file per source category
+    return os.getenv('STORAGE_BACKEND', 'csv').lower()
+
+def get_blob_store_enabled():
+    return os.getenv('BLOB_STORE', 'false').lower() in ('1', 'true', 'yes')
+
+def get_blob_store_path():
+    return os.getenv('BLOB_STORE_PATH', os.path.join(get_uploads_dir(), 'blobs'))
+
+def get_blob_compression():
+    return os.getenv('BLOB_COMPRESSION', 'gzip').lower()
+
+def get_uploads_dir():
+    return os.getenv('UPLOADS_DIR', 'uploads')
+
+def get_snapshot_generations_keep():
+    return int(os.getenv('SNAPSHOT_GENERATIONS_KEEP', '5'))
+
+def get_retry_attempts():
+    return int(os.getenv('RETRY_ATTEMPTS', '3'))
+
+def get_retry_base_delay():
+    return float(os.getenv('RETRY_BASE_DELAY', '1'))
+
+def get_retry_max_delay():
+    return float(os.getenv('RETRY_MAX_DELAY', '30'))
+
+def get_breaker_failure_threshold():
+    return int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+
+def get_breaker_reset_timeout():
+    return float(os.getenv('BREAKER_RESET_TIMEOUT', '300'))
+
+def get_selenium_grid_url():
+    return os.getenv('SELENIUM_GRID_URL', 'http://localhost:4444/wd/hub')
+
+def get_selenium_pool_size():
+    return int(os.getenv('SELENIUM_POOL_SIZE', '1'))
+
+def get_selenium_max_pages_per_session():
+    return int(os.getenv('SELENIUM_MAX_PAGES_PER_SESSION', '200'))
+
+def get_selenium_detail_workers():
+    # Defaults to one detail worker per pooled session
+    return int(os.getenv('SELENIUM_DETAIL_WORKERS', os.getenv('SELENIUM_POOL_SIZE', '1')))
+
+def get_selenium_page_load_timeout():
+    return int(os.getenv('SELENIUM_PAGE_LOAD_TIMEOUT', '120'))
+
+def get_source_time_budget(source):
+    # Wall-clock seconds a source may run, e.g. FMA_TIME_BUDGET, falling back to SOURCE_TIME_BUDGET
+    return float(os.getenv(f'{source.upper()}_TIME_BUDGET', os.getenv('SOURCE_TIME_BUDGET', '10800')))
+
+def get_source_cancel_grace():
+    # Seconds to wait for a cancelled source to wind down before giving up on it
+    return float(os.getenv('SOURCE_CANCEL_GRACE', '300'))
+
+def get_metrics_report_path():
+    return os.getenv('METRICS_REPORT_PATH', os.path.join(get_uploads_dir(), 'run_report.json'))
+
+def get_metrics_prometheus_path():
+    # Point this at the node exporter's textfile collector directory to scrape it
+    return os.getenv('METRICS_PROMETHEUS_PATH', os.path.join(get_uploads_dir(), 'metrics.prom'))
+
+def get_category_workers(source=None):
+    # Categories of one source crawled at the same time, e.g. BAFIN_COMPANY_CATEGORY_WORKERS
+    return int(_source_setting(source, 'CATEGORY_WORKERS', os.getenv('SELENIUM_POOL_SIZE', '1')))
+
+def get_fma_categories():
+    # 'all', or comma-separated category names or numbers; unset keeps the default list
+    return os.getenv('FMA_CATEGORIES')
+
+def get_url_locale():
+    # Locale parameters in links are set to this, so one page is not fetched once per language; empty drops them
+    return os.getenv('URL_LOCALE', 'en_GB')
+
+def get_fetch_cache_max_mb():
+    # Page text kept to share detail pages across categories and sources within a run; 0 disables it
+    return float(os.getenv('FETCH_CACHE_MAX_MB', '256'))
+
+def get_source_interval(source):
+    # Seconds between runs of a source in daemon mode, e.g. SIMPLE_INTERVAL, falling back to SOURCE_INTERVAL
+    return float(os.getenv(f'{source.upper()}_INTERVAL', os.getenv('SOURCE_INTERVAL', '86400')))
+
+def get_daemon_host():
+    return os.getenv('DAEMON_HOST', '0.0.0.0')
+
+def get_daemon_port():
+    # Port of the health and status endpoint; 0 disables it
+    return int(os.getenv('DAEMON_PORT', '8080'))
+
+def get_daemon_keepalive_interval():
+    # Keep idle grid sessions under the grid's session timeout (NODE_SESSION_TIMEOUT)
+    return float(os.getenv('DAEMON_KEEPALIVE_INTERVAL', '120'))
+
+def get_distributed_crawl():
+    # Hand detail pages to worker processes through the work queue
+    return os.getenv('DISTRIBUTED_CRAWL', 'false').lower() in ('1', 'true', 'yes')
+
+def get_work_queue_path():
+    # Must be on a volume shared by the coordinator and every worker
+    return os.getenv('WORK_QUEUE_PATH', os.path.join(get_uploads_dir(), 'work_queue.sqlite3'))
+
+def get_work_queue_visibility_timeout():
+    # Seconds a leased item stays hidden before another worker may retry it
+    return float(os.getenv('WORK_QUEUE_VISIBILITY_TIMEOUT', '900'))
+
+def get_work_queue_max_attempts():
+    return int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', '3'))
+
+def get_work_queue_poll_interval():
+    return float(os.getenv('WORK_QUEUE_POLL_INTERVAL', '1'))
+
+def _source_setting(source, name, default):
+    # Per-source override (e.g. FMA_BROWSER_HEADLESS) of a global setting (BROWSER_HEADLESS)
+    if source:
+        value = os.getenv(f'{source.upper()}_{name}')
+        if value is not None:
+            return value
+    return os.getenv(name, default)
+
+def _is_true(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def get_browser_profile(source=None):
+    # 'lean' (eager loads, no images, stylesheets, fonts or analytics) or 'full'
+    return _source_setting(source, 'BROWSER_PROFILE', 'lean').lower()
+
+def get_browser_headless(source=None):
+    return _is_true(_source_setting(source, 'BROWSER_HEADLESS', 'true'))
+
+def get_browser_page_load_strategy(source=None):
+    default = 'eager' if get_browser_profile(source) == 'lean' else 'normal'
+    return _source_setting(source, 'BROWSER_PAGE_LOAD_STRATEGY', default).lower()
+
+def get_browser_block_images(source=None):
+    return _is_true(_source_setting(source, 'BROWSER_BLOCK_IMAGES', str(get_browser_profile(source) == 'lean')))
+
+def get_browser_block_stylesheets(source=None):
+    return _is_true(_source_setting(source, 'BROWSER_BLOCK_STYLESHEETS', str(get_browser_profile(source) == 'lean')))
+
+def get_browser_block_fonts(source=None):
+    return _is_true(_source_setting(source, 'BROWSER_BLOCK_FONTS', str(get_browser_profile(source) == 'lean')))
+
+def get_browser_blocked_urls(source=None):
+    # Comma-separated URL patterns; the lean profile blocks common analytics and ad hosts
+    default = '*google-analytics.com*,*googletagmanager.com*,*doubleclick.net*,*etracker.*,*matomo*,*piwik*' if get_browser_profile(source) == 'lean' else ''
+    patterns = _source_setting(source, 'BROWSER_BLOCKED_URLS', default)
+    return [pattern.strip() for pattern in patterns.split(',') if pattern.strip()]
 
 def compare_data(file1, file2):
     if not os.path.exists(file1) or not os.path.exists(file2):
         return None
-    df1 = pd.read_csv(file1)
-    df2 = pd.read_csv(file2)
-    return not df1.equals(df2)
+    return file_digest(file1) != file_digest(file2)
@@ -0,0 +1,286 @@
+# work_queue.py
+import importlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from driver_pool import get_driver_pool
+from cancellation import check_cancelled
+from utils import (
+    get_work_queue_path,
+    get_work_queue_visibility_timeout,
+    get_work_queue_max_attempts,
+    get_work_queue_poll_interval,
+    get_selenium_detail_workers
+)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS work_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        batch TEXT NOT NULL,
+        source TEXT NOT NULL,
+        task TEXT NOT NULL,
+        item TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at REAL NOT NULL,
+        lease_token TEXT,
+        lease_expires REAL,
+        worker TEXT,
+        result TEXT,
+        error TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS work_items_ready ON work_items (status, available_at)",
+    "CREATE INDEX IF NOT EXISTS work_items_batch ON work_items (batch, status)"
+)
+
+# Finished items handed to the coordinator per poll, to bound the memory a poll takes
+RESULTS_PER_POLL = 100
+
+class WorkItemFailed(Exception):
+    """
+    Reported for a work item that failed on every attempt.
+    """
+
+class WorkQueue:
+    """
+    Durable queue of detail-page work items in SQLite, shared by the
+    coordinator and any number of worker processes on the same volume.
+
+    A leased item is hidden from other workers until its visibility timeout
+    runs out. A worker that crashes or hangs never reports back, so its
+    items become leasable again and are retried, up to `max_attempts`
+    leases per item.
+    """
+
+    def __init__(self, path=None, visibility_timeout=None, max_attempts=None):
+        self.path = path or get_work_queue_path()
+        self.visibility_timeout = visibility_timeout or get_work_queue_visibility_timeout()
+        self.max_attempts = max_attempts or get_work_queue_max_attempts()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")  # Polling the queue never blocks the workers' writes
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            # Take the write lock up front, so two workers can never lease the same item
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def enqueue(self, source, task, items):
+        """
+        Add one work item per entry of `items` and return the batch id they
+        are filed under.
+        """
+        batch = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO work_items (batch, source, task, item, available_at) VALUES (?, ?, ?, ?, ?)",
+                [(batch, source, task, item, now) for item in items]
+            )
+        return batch
+
+    def lease(self, worker, sources=None):
+        """
+        Lease the next ready item to `worker` and return it as a dict, or
+        None if there is nothing to do.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # Expired leases are retried, unless they have used up their attempts
+            conn.execute(
+                "UPDATE work_items SET status = 'failed', error = 'Lease expired on every attempt', lease_token = NULL "
+                "WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?",
+                (now, self.max_attempts)
+            )
+            query = (
+                "SELECT id, batch, source, task, item, attempts FROM work_items "
+                "WHERE ((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires <= ?))"
+            )
+            params = [now, now]
+            if sources:
+                query += f" AND source IN ({', '.join('?' * len(sources))})"
+                params += list(sources)
+            row = conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "UPDATE work_items SET status = 'leased', attempts = attempts + 1, lease_token = ?, lease_expires = ?, worker = ? WHERE id = ?",
+                (token, now + self.visibility_timeout, worker, row[0])
+            )
+
+        item_id, batch, source, task, item, attempts = row
+        if attempts:
+            logging.warning(f"Retrying work item {item} (attempt {attempts + 1} of {self.max_attempts}).")
+        return {'id': item_id, 'batch': batch, 'source': source, 'task': task, 'item': item, 'token': token}
+
+    def complete(self, item, result):
+        """
+        Report the result of a leased item. Returns False if the lease has
+        already passed to another worker.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE work_items SET status = 'done', result = ?, lease_token = NULL WHERE id = ? AND lease_token = ?",
+                (json.dumps(result), item['id'], item['token'])
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, item, error):
+        """
+        Report a failed attempt; the item is retried after a short delay
+        while it has attempts left.
+        """
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE work_items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "error = ?, available_at = ? + MIN(60, attempts * 5), lease_token = NULL WHERE id = ? AND lease_token = ?",
+                (self.max_attempts, str(error), time.time(), item['id'], item['token'])
+            )
+
+    def take_results(self, batch):
+        """
+        Remove the finished items of `batch` from the queue and return them
+        as `(item, result, error)` tuples.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, item, status, result, error FROM work_items WHERE batch = ? AND status IN ('done', 'failed') ORDER BY id LIMIT ?",
+                (batch, RESULTS_PER_POLL)
+            ).fetchall()
+            conn.executemany("DELETE FROM work_items WHERE id = ?", [(row[0],) for row in rows])
+        return [
+            (item, json.loads(result), None) if status == 'done' else (item, None, WorkItemFailed(error))
+            for _, item, status, result, error in rows
+        ]
+
+    def cancel(self, batch):
+        # Drop whatever is left of the batch; late reports for it are ignored
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM work_items WHERE batch = ?", (batch,))
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_work_queue():
+    """
+    Return the process-wide work queue, opening it on first use.
+    """
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = WorkQueue()
+        return _queue
+
+def task_name(fn):
+    """
+    Return the 'module:function' name a worker resolves `fn` by, or None if
+    `fn` cannot be imported by name, e.g. a lambda.
+    """
+    name = f"{fn.__module__}:{fn.__qualname__}"
+    return None if '<' in name or fn.__module__ == '__main__' else name
+
+def resolve_task(name):
+    module_name, _, function_name = name.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def fetch_queued(items, fetch_fn, source):
+    """
+    Same as detail_fetcher.fetch_details, but files the items as work items
+    and yields the results the worker processes report back, in completion
+    order. Unfinished items are withdrawn if the consumer stops early.
+    """
+    items = list(items)
+    if not items:
+        return
+
+    work_queue = get_work_queue()
+    batch = work_queue.enqueue(source, task_name(fetch_fn), items)
+    logging.info(f"Queued {len(items)} detail pages for the workers.")
+    poll_interval = get_work_queue_poll_interval()
+    remaining = len(items)
+    waiting_since = time.monotonic()
+    try:
+        while remaining:
+            check_cancelled()
+            results = work_queue.take_results(batch)
+            if not results:
+                if time.monotonic() - waiting_since >= 60:
+                    logging.info(f"Waiting for workers to finish {remaining} of {len(items)} detail pages.")
+                    waiting_since = time.monotonic()
+                time.sleep(poll_interval)
+                continue
+            waiting_since = time.monotonic()
+            remaining -= len(results)
+            yield from results
+    finally:
+        work_queue.cancel(batch)
+
+def _process(work_queue, item):
+    try:
+        fetch_fn = resolve_task(item['task'])
+        with get_driver_pool(item['source']).lease() as driver:
+            result = fetch_fn(driver, item['item'])
+    except Exception as e:
+        logging.error(f"Error fetching work item {item['item']}: {e}")
+        work_queue.fail(item, e)
+        return
+    if not work_queue.complete(item, result):
+        logging.warning(f"Lease on work item {item['item']} expired before it was reported.")
+
+def _work(work_queue, worker, sources, stop, idle_timeout):
+    poll_interval = get_work_queue_poll_interval()
+    idle_since = time.monotonic()
+    while not stop.is_set():
+        item = work_queue.lease(worker, sources)
+        if item is None:
+            if idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                return
+            stop.wait(poll_interval)
+            continue
+        _process(work_queue, item)
+        idle_since = time.monotonic()
+
+def run_worker(sources=None, threads=None, stop=None, idle_timeout=None):
+    """
+    Lease and fetch work items on `threads` grid sessions until `stop` is
+    set or, with `idle_timeout`, until the queue has had nothing for that
+    many seconds. The item in hand is always finished before stopping.
+    """
+    work_queue = get_work_queue()
+    threads = threads or get_selenium_detail_workers()
+    stop = stop or threading.Event()
+    worker = f"{socket.gethostname()}-{os.getpid()}"
+    logging.info(f"Worker {worker} started with {threads} threads.")
+
+    workers = [
+        threading.Thread(target=_work, args=(work_queue, f"{worker}-{i}", sources, stop, idle_timeout), name=f"worker-{i}", daemon=True)
+        for i in range(threads)
+    ]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        # Join in short steps so the main thread keeps handling signals
+        while thread.is_alive():
+            thread.join(1)
+    logging.info(f"Worker {worker} stopped.")